@@ -5,6 +5,7 @@
 import os
 import arcpy
 import logging
+import results_catalog
 
 # Set workspace file for ArcGIS, enable overwriting, and retrieve Spatial Analyst extension license
 arcpy.env.workspace = os.path.abspath('')
@@ -18,6 +19,8 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 # SET THE RESULT FOLDER HERE
 # example: 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\results\\110'
 results_folder = 'FOLDER PATH HERE'
+# results catalog of the float files (None = a catalog for this folder on the local disk, see results_catalog.default_db)
+catalog_db = None
 
 # SET CLIPPING SHAPEFILE HERE
 clip_shapefile = 'SHAPEFILE HERE'
@@ -42,35 +45,14 @@ def clip_to_float(flt_filename, run_dir, *args, **kwargs):
     logging.info(f'Saved clipped file to: {clipped_flt_filename}')
     return clipped_flt_filename
 
-# Return the highest domain time among float files
-def time_final_output(files):
-    # get time part from file strings
-    time_strs = [f.replace('.flt', '').split('_')[-2:] for f in files]
-    # convert to float
-    times = [float(t[0] + '.' + t[1]) for t in time_strs]
-    max_time = max(times)
-    max_str = ('%06.2f' % max_time).replace('.', '_')
-    return max_str
-
 if __name__ == "__main__":
-    # get top-level subdirs of results folder for each run
-    run_dirs = [os.path.join(results_folder, run_dir) for run_dir in next(os.walk(results_folder))[1]]
-    # iterate over runs
-    for run_dir in run_dirs:
-        # make list of float files ending in 00.flt
-        flt_files = []
-        for dir, subdirs, files in os.walk(run_dir):
-            for flt_file in files:
-                if flt_file.endswith('00.flt'):
-                        flt_filename = os.path.join(dir, flt_file)  # path of float file in results folder
-                        flt_files.append(flt_filename)
+    # refresh the results catalog (only folders changed since the last run are listed)
+    con = results_catalog.catalog(results_folder, catalog_db)
+    # float rasters at the final output time of each run
+    end_files = results_catalog.final_outputs(con, results_folder)
+    con.close()
+
+    # run clip to float
+    for run_dir, end_file in end_files:
         grids_folder = os.path.join(run_dir, 'grids')
-
-        # get last raster output time as string
-        max_time = time_final_output(flt_files)
-        # list of all float rasters at final time for the run
-        end_files = [f for f in flt_files if f.endswith(f'{max_time}.flt')]
-
-        # run clip to float
-        for end_file in end_files:
-            clip_to_float(end_file, grids_folder)
\ No newline at end of file
+        clip_to_float(end_file, grids_folder)
\ No newline at end of file
@@ -2,13 +2,9 @@
 # Created by SJP, last edited 02/01/2021
 
 import os
-import arcpy
 import logging
-
-# Set workspace file for ArcGIS, enable overwriting, and retrieve Spatial Analyst extension license
-arcpy.env.workspace = os.path.abspath('')
-arcpy.env.overwriteOutput = True
-arcpy.CheckOutExtension('Spatial')
+import results_catalog
+from geotiff import flt_to_tif
 
 # logging format
 FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
@@ -19,13 +15,14 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 results_folder = 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_2_DPRMRY\\results\\143'
 # example: 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\review'
 raster_folder = 'D:\\LYR_Restore\\baseline_rasters'
+# results catalog of the float files (None = a catalog for this folder on the local disk, see results_catalog.default_db)
+catalog_db = None
 
 def float_to_raster(flt_filename, *args, **kwargs):
     logging.info(f'Converting from float to TIFF: {flt_filename}...')
-    flt_raster = arcpy.Raster(flt_filename)
     tif_file = os.path.basename(flt_filename).replace('.flt', '.tif')
     tif_filename = os.path.join(discharge_folder, tif_file)
-    arcpy.FloatToRaster_conversion(flt_raster, tif_filename)
+    flt_to_tif(flt_filename, tif_filename)
     logging.info(f'Saved TIFF file to: {tif_filename}')
     return tif_filename
 
@@ -42,32 +39,16 @@ def make_discharge_folder(run_dir):
         os.makedirs(discharge_folder)
     return discharge_folder
 
-# Return the highest domain time among float files
-def time_final_output(files):
-    # get time part from file strings
-    time_strs = [f.replace('.flt', '').split('_')[-2:] for f in files]
-    # convert to float
-    times = [float(t[0] + '.' + t[1]) for t in time_strs]
-    max_time = max(times)
-    max_str = ('%06.2f' % max_time).replace('.', '_')
-    return max_str
-
 if __name__ == "__main__":
-    for dir, subdirs, files in os.walk(results_folder):
-        # iterate over runs
-        for flt_file in files:
-            if flt_file.endswith('00.flt'):
-                flt_filename = os.path.join(dir, flt_file)  # path of float file in results folder
-                flt_files.append(flt_filename)
-
-            # get last raster output time as string
-            max_time = time_final_output(flt_files)
-            # list of all float rasters at final time for the run
-            end_files = [f for f in flt_files if f.endswith(f'{max_time}.flt')]
-
-            # make discharge folder in run_id folder
-            discharge_folder = make_discharge_folder(run_dir)
-
-            # run float to raster conversion
-            for end_file in end_files:
-               float_to_raster(end_file, discharge_folder)
\ No newline at end of file
+    # refresh the results catalog (only folders changed since the last run are listed)
+    con = results_catalog.catalog(results_folder, catalog_db)
+    # float rasters at the final output time of each run
+    end_files = results_catalog.final_outputs(con, results_folder)
+    con.close()
+
+    for run_dir, end_file in end_files:
+        # make discharge folder in run_id folder
+        discharge_folder = make_discharge_folder(run_dir)
+
+        # run float to raster conversion
+        float_to_raster(end_file, discharge_folder)
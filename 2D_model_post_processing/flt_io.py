@@ -0,0 +1,111 @@
+# Reads and writes ESRI float grids (.flt + .hdr, as output by TUFLOW) as NumPy arrays, without ArcGIS
+# The .flt is opened as a memory-mapped array, so only the rows that are used are read from disk
+# Keep this file next to the post-processing scripts that import it
+
+import os
+import numpy as np
+
+# header keys of an ESRI float grid, in the order they are written
+HDR_KEYS = ['ncols', 'nrows', 'xllcorner', 'yllcorner', 'cellsize', 'NODATA_value', 'byteorder']
+
+
+def read_hdr(flt_filename):
+    """Returns the .hdr of a float grid as a dict (cell centre coordinates converted to lower left corner)"""
+    hdr = {'NODATA_value': -9999.0, 'byteorder': 'LSBFIRST'}
+    with open(os.path.splitext(flt_filename)[0] + '.hdr') as f:
+        for line in f:
+            if line.strip():
+                key, value = line.split()[:2]
+                hdr[key.lower()] = value
+    header = {'ncols': int(hdr['ncols']), 'nrows': int(hdr['nrows']), 'cellsize': float(hdr['cellsize']),
+              'NODATA_value': float(hdr.get('nodata_value', hdr['NODATA_value'])),
+              'byteorder': hdr.get('byteorder', hdr['byteorder']).upper()}
+    for axis in ['x', 'y']:
+        if f'{axis}llcorner' in hdr:
+            header[f'{axis}llcorner'] = float(hdr[f'{axis}llcorner'])
+        else:
+            header[f'{axis}llcorner'] = float(hdr[f'{axis}llcenter']) - header['cellsize'] / 2
+    return header
+
+
+def write_hdr(flt_filename, header):
+    """Writes the .hdr of a float grid from a header dict"""
+    with open(os.path.splitext(flt_filename)[0] + '.hdr', 'w') as f:
+        for key in HDR_KEYS:
+            f.write(f'{key:<14}{header[key]}\n')
+
+
+def read_prj(flt_filename):
+    """Returns the projection (WKT) of a float grid from its .prj, or None if there is no .prj"""
+    prj_filename = os.path.splitext(flt_filename)[0] + '.prj'
+    if not os.path.exists(prj_filename):
+        return None
+    with open(prj_filename) as f:
+        return f.read().strip()
+
+
+def flt_dtype(header):
+    """Returns the NumPy dtype of the float32 cells of a grid with the given header"""
+    return np.dtype('>f4') if header['byteorder'] == 'MSBFIRST' else np.dtype('<f4')
+
+
+def open_flt(flt_filename, mode='r'):
+    """Returns a float grid as a memory-mapped (nrows, ncols) array (mode 'r' or 'r+') and its header dict"""
+    header = read_hdr(flt_filename)
+    cells = np.memmap(flt_filename, dtype=flt_dtype(header), mode=mode, shape=(header['nrows'], header['ncols']))
+    return cells, header
+
+
+def create_flt(flt_filename, header, prj=None):
+    """Creates a float grid (.flt, .hdr and .prj if given) and returns it as a writable memory-mapped array"""
+    header = dict(header, byteorder=header.get('byteorder', 'LSBFIRST'))
+    write_hdr(flt_filename, header)
+    if prj:
+        with open(os.path.splitext(flt_filename)[0] + '.prj', 'w') as f:
+            f.write(prj)
+    return np.memmap(flt_filename, dtype=flt_dtype(header), mode='w+', shape=(header['nrows'], header['ncols']))
+
+
+def write_flt(flt_filename, cells, header, prj=None):
+    """Writes a 2D array to a float grid (the header ncols/nrows are taken from the array)"""
+    header = dict(header, nrows=cells.shape[0], ncols=cells.shape[1])
+    out = create_flt(flt_filename, header, prj)
+    out[:] = cells
+    out.flush()
+    del out
+    return flt_filename
+
+
+def read_window(cells, header, row_off, col_off, nrows, ncols, nodata_to_nan=True):
+    """Returns a block of a grid (rows/columns from the top left) as a float32 array, NODATA cells as NaN"""
+    block = np.array(cells[row_off:row_off + nrows, col_off:col_off + ncols], dtype=np.float32)
+    if nodata_to_nan:
+        block[block == header['NODATA_value']] = np.nan
+    return block
+
+
+def bounds(header):
+    """Returns the (xmin, ymin, xmax, ymax) extent of a grid"""
+    return (header['xllcorner'], header['yllcorner'],
+            header['xllcorner'] + header['ncols'] * header['cellsize'],
+            header['yllcorner'] + header['nrows'] * header['cellsize'])
+
+
+def window_from_bounds(header, xmin, ymin, xmax, ymax):
+    """Returns the (row_off, col_off, nrows, ncols) window of a grid covering an extent, clipped to the grid"""
+    cellsize = header['cellsize']
+    top = header['yllcorner'] + header['nrows'] * cellsize
+    col0 = max(int(np.floor((xmin - header['xllcorner']) / cellsize)), 0)
+    col1 = min(int(np.ceil((xmax - header['xllcorner']) / cellsize)), header['ncols'])
+    row0 = max(int(np.floor((top - ymax) / cellsize)), 0)
+    row1 = min(int(np.ceil((top - ymin) / cellsize)), header['nrows'])
+    return row0, col0, max(row1 - row0, 0), max(col1 - col0, 0)
+
+
+def is_aligned(header, snap_header):
+    """Returns True if the cells of a grid line up with the cells of a snap grid (same cell size, whole cell offset)"""
+    cellsize = snap_header['cellsize']
+    if not np.isclose(header['cellsize'], cellsize):
+        return False
+    offsets = [(header[key] - snap_header[key]) / cellsize for key in ['xllcorner', 'yllcorner']]
+    return all(abs(offset - round(offset)) < 1e-3 for offset in offsets)
@@ -0,0 +1,321 @@
+# Writes float32 GeoTIFF rasters tile by tile from NumPy arrays (e.g. memory-mapped .flt grids from flt_io.py), and
+# reads the georeferencing and windows of single band GeoTIFF rasters (uncompressed, LZW, deflate or PackBits), without
+# ArcGIS or GDAL
+# Tiles are deflate compressed with the floating point predictor, and only one row of tiles is held in memory at a time
+# Keep this file next to the post-processing scripts that import it
+
+import zlib
+import struct
+import numpy as np
+import flt_io
+
+# TIFF field types: (struct format, size in bytes)
+TIFF_TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8)}
+SHORT, LONG, DOUBLE, ASCII, LONG8 = 3, 4, 12, 2, 16
+# GeoKeyDirectory, GeoDoubleParams and GeoAsciiParams tags and their types
+GEO_KEY_TAGS = {34735: SHORT, 34736: DOUBLE, 34737: ASCII}
+# compressions that can be read
+COMPRESSIONS = {1: 'none', 5: 'LZW', 8: 'deflate', 32946: 'deflate', 32773: 'PackBits'}
+# SampleFormat (1 = unsigned integer, 2 = signed integer, 3 = floating point) to NumPy dtype kind
+SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def encode_tile(tile, compress=True, level=6):
+    """Returns the bytes of a float32 tile, deflate compressed with the floating point predictor (predictor 3)"""
+    if not compress:
+        return np.ascontiguousarray(tile, dtype='<f4').tobytes()
+    rows, cols = tile.shape
+    # floating point predictor: big-endian bytes of each row regrouped by byte significance, then differenced
+    planes = np.ascontiguousarray(tile, dtype='>f4').view(np.uint8).reshape(rows, cols, 4).transpose(0, 2, 1).reshape(rows, 4 * cols)
+    diffs = planes.copy()
+    diffs[:, 1:] = np.diff(planes, axis=1)
+    return zlib.compress(diffs.tobytes(), level)
+
+
+def lzw_decode(data):
+    """Returns the bytes of a TIFF LZW compressed tile or strip (MSB first codes of 9 to 12 bits, early change)"""
+    data = bytes(data) + b'\0\0\0'
+    n_bits = (len(data) - 3) * 8
+    chunks = []
+    append = chunks.append
+    table = [bytes([i]) for i in range(256)] + [b'', b'']
+    width = 9
+    mask = 511
+    # table size at which the code width grows (one code before the table is full, TIFF early change)
+    grow_at = 511
+    previous = None
+    position = 0
+    while position + width <= n_bits:
+        i = position >> 3
+        code = ((data[i] << 16 | data[i + 1] << 8 | data[i + 2]) >> (24 - (position & 7) - width)) & mask
+        position += width
+        if code == 256:
+            # clear code: back to the single byte table
+            del table[258:]
+            width, mask, grow_at = 9, 511, 511
+            previous = None
+            continue
+        if code == 257:
+            break
+        if previous is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) else previous + previous[:1]
+            table.append(previous + entry[:1])
+            if len(table) >= grow_at and width < 12:
+                width += 1
+                mask = (1 << width) - 1
+                grow_at = mask
+        append(entry)
+        previous = entry
+    return b''.join(chunks)
+
+
+def packbits_decode(data):
+    """Returns the bytes of a PackBits compressed tile or strip"""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        header = data[i]
+        if header < 128:
+            out += data[i + 1:i + 2 + header]
+            i += 2 + header
+        else:
+            if header > 128:
+                out += data[i + 1:i + 2] * (257 - header)
+            i += 2 if header > 128 else 1
+    return bytes(out)
+
+
+def tiff_dtype(tags, tif_filename=''):
+    """Returns the NumPy dtype of a single band TIFF from its tags, raises ValueError if it cannot be read"""
+    compression = tags.get(259, (1,))[0]
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'{tif_filename}: TIFF compression {compression} is not supported '
+                         f'(only {", ".join(sorted(set(COMPRESSIONS.values())))})')
+    if tags.get(277, (1,))[0] != 1:
+        raise ValueError(f'{tif_filename} is not a single band TIFF')
+    sample_format = tags.get(339, (1,))[0]
+    bits = tags.get(258, (1,))[0]
+    if sample_format not in SAMPLE_KINDS or bits not in [8, 16, 32, 64] or (sample_format == 3 and bits < 32):
+        raise ValueError(f'{tif_filename}: {bits} bit samples of format {sample_format} are not supported')
+    if tags.get(317, (1,))[0] not in [1, 2, 3]:
+        raise ValueError(f'{tif_filename}: TIFF predictor {tags[317][0]} is not supported')
+    return np.dtype(tags['byteorder'] + SAMPLE_KINDS[sample_format] + str(bits // 8))
+
+
+def decode_tile(data, rows, cols, compression, predictor, byteorder='<', dtype='f4'):
+    """Returns a tile (or strip) from its bytes (compression none, LZW, deflate or PackBits, predictor 1, 2 or 3) as
+    float32, dtype is the type of the samples (without byte order)"""
+    if compression in [8, 32946]:
+        data = zlib.decompress(data)
+    elif compression == 5:
+        data = lzw_decode(data)
+    elif compression == 32773:
+        data = packbits_decode(data)
+    elif compression != 1:
+        raise ValueError(f'TIFF compression {compression} is not supported')
+    dtype = np.dtype(dtype)
+    size = dtype.itemsize
+    if predictor == 3:
+        # floating point predictor: bytes of each row grouped by significance (big-endian), differenced
+        planes = np.cumsum(np.frombuffer(data, dtype=np.uint8, count=rows * cols * size).reshape(rows, size * cols), axis=1, dtype=np.uint8)
+        tile = planes.reshape(rows, size, cols).transpose(0, 2, 1).copy().view('>' + dtype.str[1:]).reshape(rows, cols)
+        return tile.astype(np.float32)
+    tile = np.frombuffer(data, dtype=dtype.newbyteorder(byteorder), count=rows * cols).reshape(rows, cols)
+    if predictor == 2:
+        # horizontal differencing of the samples as integers of the same size
+        native = tile.dtype.newbyteorder('=')
+        tile = np.cumsum(tile.astype(native).view(f'u{size}'), axis=1, dtype=f'u{size}').view(native)
+    return tile.astype(np.float32)
+
+
+def geo_keys(epsg=None, prj=None):
+    """Returns the GeoKey tags (tag: values) of a projected raster (EPSG code, or the ESRI WKT from a .prj)"""
+    # GTModelType = projected, GTRasterType = pixel is area
+    keys = [(1024, 0, 1, 1), (1025, 0, 1, 1)]
+    ascii_params = ''
+    if epsg:
+        keys.append((3072, 0, 1, int(epsg)))
+    elif prj:
+        # user-defined projection, described by its ESRI WKT in the PCS citation (read by GDAL and ArcGIS)
+        ascii_params = f'ESRI PE String = {prj}|'
+        keys += [(3072, 0, 1, 32767), (3073, 34737, len(ascii_params), 0)]
+    directory = [1, 1, 0, len(keys)] + [value for key in keys for value in key]
+    if ascii_params:
+        return {34735: directory, 34737: ascii_params}
+    return {34735: directory}
+
+
+def read_geo_keys(tags):
+    """Returns the GeoKey tags (tag: values) of a GeoTIFF from its tags, to write them unchanged to another GeoTIFF"""
+    return {tag: tags[tag] for tag in GEO_KEY_TAGS if tag in tags}
+
+
+def write_geotiff(tif_filename, cells, header, epsg=None, prj=None, tile_size=256, compress=True, geokeys=None):
+    """Writes a 2D array (e.g. a memory-mapped .flt) to a tiled float32 GeoTIFF, one tile at a time"""
+    bands = (cells[row0:row0 + tile_size] for row0 in range(0, cells.shape[0], tile_size))
+    write_geotiff_bands(tif_filename, bands, header, epsg, prj, tile_size, compress, geokeys)
+
+
+def write_geotiff_bands(tif_filename, bands, header, epsg=None, prj=None, tile_size=256, compress=True, geokeys=None):
+    """Writes a tiled float32 GeoTIFF from an iterable of row bands (tile_size rows by ncols, from the top, in order)
+    the GeoKeys are from an EPSG code, a .prj WKT or given as tags (e.g. read_geo_keys of another GeoTIFF)"""
+    nrows, ncols = header['nrows'], header['ncols']
+    nodata = header['NODATA_value']
+    tiles_down = -(-nrows // tile_size)
+    tiles_across = -(-ncols // tile_size)
+    # BigTIFF if the raster could be larger than 4 GB
+    big = nrows * ncols * 4 + tiles_down * tiles_across * 64 >= 2 ** 32 - 2 ** 20
+    offset_type = LONG8 if big else LONG
+    offsets = []
+    byte_counts = []
+    with open(tif_filename, 'wb') as f:
+        f.write(struct.pack('<2sHHHQ', b'II', 43, 8, 0, 0) if big else struct.pack('<2sHI', b'II', 42, 0))
+        tile = np.empty((tile_size, tile_size), dtype=np.float32)
+        for tile_row, band in zip(range(tiles_down), bands):
+            for tile_col in range(tiles_across):
+                col0 = tile_col * tile_size
+                block = band[:tile_size, col0:col0 + tile_size]
+                # edge tiles are padded with NODATA to the full tile size
+                tile.fill(nodata)
+                tile[:block.shape[0], :block.shape[1]] = block
+                data = encode_tile(tile, compress)
+                offsets.append(f.tell())
+                byte_counts.append(len(data))
+                f.write(data)
+
+        top = header['yllcorner'] + nrows * header['cellsize']
+        tags = [(256, LONG, [ncols]), (257, LONG, [nrows]), (258, SHORT, [32]), (259, SHORT, [8 if compress else 1]),
+                (262, SHORT, [1]), (277, SHORT, [1]), (284, SHORT, [1]), (317, SHORT, [3 if compress else 1]),
+                (322, LONG, [tile_size]), (323, LONG, [tile_size]), (324, offset_type, offsets),
+                (325, offset_type, byte_counts), (339, SHORT, [3]),
+                (33550, DOUBLE, [header['cellsize'], header['cellsize'], 0.0]),
+                (33922, DOUBLE, [0.0, 0.0, 0.0, header['xllcorner'], top, 0.0])]
+        tags += [(tag, GEO_KEY_TAGS[tag], values) for tag, values in (geokeys or geo_keys(epsg, prj)).items()]
+        tags.append((42113, ASCII, '%.10g' % nodata))
+        write_ifd(f, tags, big)
+
+
+def write_ifd(f, tags, big=False):
+    """Writes the image file directory (sorted tags) at the end of an open TIFF and points the TIFF header to it"""
+    entry_format, count_format, inline_size = ('<HHQ', '<Q', 8) if big else ('<HHI', '<I', 4)
+    if f.tell() % 2:
+        f.write(b'\0')
+    ifd_offset = f.tell()
+    entries_size = (8 if big else 2) + len(tags) * (20 if big else 12) + (8 if big else 4)
+    # values that do not fit in an entry are written after the directory
+    extra = b''
+    entries = b''
+    for tag, field_type, values in sorted(tags):
+        if field_type == ASCII:
+            value_bytes = values.encode() + b'\0'
+            count = len(value_bytes)
+        else:
+            count = len(values)
+            value_bytes = struct.pack('<%i%s' % (count, TIFF_TYPES[field_type][0]), *values)
+        if len(value_bytes) <= inline_size:
+            value_field = value_bytes.ljust(inline_size, b'\0')
+        else:
+            value_field = struct.pack(count_format, ifd_offset + entries_size + len(extra))
+            extra += value_bytes + (b'\0' if len(value_bytes) % 2 else b'')
+        entries += struct.pack(entry_format, tag, field_type, count) + value_field
+    f.write(struct.pack(count_format if big else '<H', len(tags)) + entries + struct.pack(count_format, 0) + extra)
+    # first IFD offset in the TIFF header
+    f.seek(8 if big else 4)
+    f.write(struct.pack(count_format, ifd_offset))
+
+
+def read_tags(tif_filename):
+    """Returns the tags of the first image of a TIFF (classic or BigTIFF) as a dict of tag: value tuple (or string)"""
+    with open(tif_filename, 'rb') as f:
+        byteorder = '<' if f.read(2) == b'II' else '>'
+        version, = struct.unpack(byteorder + 'H', f.read(2))
+        big = version == 43
+        if big:
+            f.read(4)
+            ifd_offset, = struct.unpack(byteorder + 'Q', f.read(8))
+        else:
+            ifd_offset, = struct.unpack(byteorder + 'I', f.read(4))
+        f.seek(ifd_offset)
+        n_tags, = struct.unpack(byteorder + ('Q' if big else 'H'), f.read(8 if big else 2))
+        entries = f.read(n_tags * (20 if big else 12))
+        tags = {'byteorder': byteorder}
+        for i in range(n_tags):
+            entry = entries[i * (20 if big else 12):(i + 1) * (20 if big else 12)]
+            tag, field_type = struct.unpack(byteorder + 'HH', entry[:4])
+            count, = struct.unpack(byteorder + ('Q' if big else 'I'), entry[4:12] if big else entry[4:8])
+            value_field = entry[12:] if big else entry[8:]
+            if field_type not in TIFF_TYPES:
+                continue
+            fmt, size = TIFF_TYPES[field_type]
+            if count * size <= len(value_field):
+                value_bytes = value_field[:count * size]
+            else:
+                position = f.tell()
+                f.seek(struct.unpack(byteorder + ('Q' if big else 'I'), value_field)[0])
+                value_bytes = f.read(count * size)
+                f.seek(position)
+            if field_type == ASCII:
+                tags[tag] = value_bytes.rstrip(b'\0').decode(errors='replace')
+            else:
+                tags[tag] = struct.unpack(byteorder + '%i%s' % (count, fmt), value_bytes)
+    return tags
+
+
+def read_georef(tif_filename):
+    """Returns the header dict (as flt_io.read_hdr) of a north-up GeoTIFF from its pixel scale and tiepoint tags"""
+    tags = read_tags(tif_filename)
+    cellsize = tags[33550][0]
+    tiepoint = tags[33922]
+    ncols, nrows = tags[256][0], tags[257][0]
+    # tiepoint raster (i, j) to model (x, y)
+    xll = tiepoint[3] - tiepoint[0] * cellsize
+    top = tiepoint[4] + tiepoint[1] * cellsize
+    return {'ncols': ncols, 'nrows': nrows, 'xllcorner': xll, 'yllcorner': top - nrows * cellsize, 'cellsize': cellsize,
+            'NODATA_value': float(tags[42113]) if 42113 in tags else -9999.0, 'byteorder': 'LSBFIRST'}
+
+
+def read_geotiff_window(tif_filename, tags, row_off, col_off, nrows, ncols):
+    """Returns a block of a single band GeoTIFF (rows/columns from the top left) as a float32 array, NODATA as NaN
+    only the tiles or strips the block covers are read, cells outside the raster are NaN"""
+    dtype = tiff_dtype(tags, tif_filename)
+    raster_rows, raster_cols = tags[257][0], tags[256][0]
+    compression = tags.get(259, (1,))[0]
+    predictor = tags.get(317, (1,))[0]
+    # strips are read as tiles the width of the raster
+    if 322 in tags:
+        tile_cols, tile_rows = tags[322][0], tags[323][0]
+        offsets, byte_counts = tags[324], tags[325]
+    else:
+        tile_cols, tile_rows = raster_cols, tags.get(278, (raster_rows,))[0]
+        offsets, byte_counts = tags[273], tags[279]
+    tiles_across = -(-raster_cols // tile_cols)
+    block = np.full((nrows, ncols), np.nan, dtype=np.float32)
+    row0, row1 = max(row_off, 0), min(row_off + nrows, raster_rows)
+    col0, col1 = max(col_off, 0), min(col_off + ncols, raster_cols)
+    if row0 >= row1 or col0 >= col1:
+        return block
+    with open(tif_filename, 'rb') as f:
+        for tile_row in range(row0 // tile_rows, (row1 - 1) // tile_rows + 1):
+            for tile_col in range(col0 // tile_cols, (col1 - 1) // tile_cols + 1):
+                i = tile_row * tiles_across + tile_col
+                # the last strip may be shorter than the rows per strip
+                rows = tile_rows if 322 in tags else min(tile_rows, raster_rows - tile_row * tile_rows)
+                f.seek(offsets[i])
+                tile = decode_tile(f.read(byte_counts[i]), rows, tile_cols, compression, predictor, tags['byteorder'], dtype)
+                # overlap of the tile and the block in raster rows/columns
+                r0, r1 = max(row0, tile_row * tile_rows), min(row1, tile_row * tile_rows + rows)
+                c0, c1 = max(col0, tile_col * tile_cols), min(col1, (tile_col + 1) * tile_cols)
+                block[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = \
+                    tile[r0 - tile_row * tile_rows:r1 - tile_row * tile_rows, c0 - tile_col * tile_cols:c1 - tile_col * tile_cols]
+    if 42113 in tags:
+        block[block == np.float32(float(tags[42113]))] = np.nan
+    return block
+
+
+def flt_to_tif(flt_filename, tif_filename, epsg=None, tile_size=256):
+    """Converts a .flt grid to a tiled, compressed float32 GeoTIFF (projection from the .prj unless an EPSG is given)"""
+    cells, header = flt_io.open_flt(flt_filename)
+    write_geotiff(tif_filename, cells, header, epsg=epsg, prj=flt_io.read_prj(flt_filename), tile_size=tile_size)
+    return tif_filename
@@ -2,22 +2,27 @@
 # Created by SJP, last updated 06/24/21
 
 import os
-import arcpy
 import logging
+import numpy as np
+import geotiff
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # ****VARIABLES - MAKE CHANGES HERE****
 discharges = [42200, 47166, 62550, 74445, 84400, 87100, 92591, 106445, 110400]
 # Dictionary Key: 1: "Globaln_10ft", 2: "Globaln_3ft", 3: "Spatialn_10ft",
 #                 4: "Spatialn_3ft", 5: "Combinedn_10ft", 6:"Combinedn_3ft"
 mr = 5
+# value kept where reach rasters overlap: "FIRST" (upstream reach first), "LAST", "MEAN", "MIN" or "MAX"
+mosaic_method = "FIRST"
+# number of merges (parameter and discharge) run at once
+workers = 4
 
 
 # DO NOT CHANGE SCRIPT BELOW UNLESS YOU KNOW WHAT YOU ARE DOING
-# Set workspace file for ArcGIS, enable overwriting, and retrieve Spatial Analyst extension license
-arcpy.env.workspace = os.path.abspath('')
-arcpy.env.overwriteOutput = True
-arcpy.CheckOutExtension('Spatial')
-arcpy.env.snapRaster = 'Z:\\LYR\\LYR_2017studies\\LYR17_Topo\\LYR17_DEM\\09-Final_2017_DEM\\With_Structures\\LYR17_Final_DEM_with_str_adjusted.tif'
+# snap raster (DEM) the merged rasters are aligned to
+snap_raster = 'Z:\\LYR\\LYR_2017studies\\LYR17_Topo\\LYR17_DEM\\09-Final_2017_DEM\\With_Structures\\LYR17_Final_DEM_with_str_adjusted.tif'
+# rows of the merged raster computed at once (one row of GeoTIFF tiles)
+band_rows = 256
 
 # logging format
 FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
@@ -32,7 +37,90 @@ par_ras_dict = {"V": "u", "d": "d", "h": "h", "BSS": "t"}
 source_folder = "Z:\\LYR\\LYR_2017studies\\LYR17_Hydraulics"
 
 
-def merge_hydraulic_rasters():
+def mosaic_header(headers, cellsize, snap_header=None, nodata=-9999.0):
+    """Returns the header of a grid covering all input rasters, with its lower left corner on the snap raster cells"""
+    snap_header = snap_header or headers[0]
+    xmin = min(header['xllcorner'] for header in headers)
+    ymin = min(header['yllcorner'] for header in headers)
+    xmax = max(header['xllcorner'] + header['ncols'] * header['cellsize'] for header in headers)
+    ymax = max(header['yllcorner'] + header['nrows'] * header['cellsize'] for header in headers)
+    snap_cellsize = snap_header['cellsize']
+    xll = snap_header['xllcorner'] + np.floor((xmin - snap_header['xllcorner']) / snap_cellsize) * snap_cellsize
+    yll = snap_header['yllcorner'] + np.floor((ymin - snap_header['yllcorner']) / snap_cellsize) * snap_cellsize
+    return {'ncols': int(np.ceil(round((xmax - xll) / cellsize, 6))), 'nrows': int(np.ceil(round((ymax - yll) / cellsize, 6))),
+            'xllcorner': float(xll), 'yllcorner': float(yll), 'cellsize': float(cellsize), 'NODATA_value': nodata,
+            'byteorder': 'LSBFIRST'}
+
+
+def cell_index(coords, origin, cellsize, n):
+    """Returns the input raster cells (nearest) under output cell centre coordinates, and the slice of coordinates inside it"""
+    index = np.floor((coords - origin) / cellsize).astype(np.int64)
+    inside = np.flatnonzero((index >= 0) & (index < n))
+    if not inside.size:
+        return index, None
+    return index, slice(inside[0], inside[-1] + 1)
+
+
+def mosaic_bands(inputs, header, method='FIRST', band_rows=256):
+    """Yields the mosaic of the input rasters on the output grid in bands of rows (from the top), with NODATA cells
+    inputs are (tif filename, tags, header) in order (first = kept by FIRST), read one window per band"""
+    cellsize = header['cellsize']
+    top = header['yllcorner'] + header['nrows'] * cellsize
+    # input columns under each output column
+    x = header['xllcorner'] + (np.arange(header['ncols']) + 0.5) * cellsize
+    col_index = [cell_index(x, in_header['xllcorner'], in_header['cellsize'], in_header['ncols'])
+                 for tif_filename, tags, in_header in inputs]
+    for row0 in range(0, header['nrows'], band_rows):
+        rows = min(band_rows, header['nrows'] - row0)
+        band = np.full((rows, header['ncols']), np.nan, dtype=np.float32)
+        count = np.zeros(band.shape, dtype=np.int32)
+        y = top - (row0 + np.arange(rows) + 0.5) * cellsize
+        for (tif_filename, tags, in_header), (in_cols, cols) in zip(inputs, col_index):
+            in_top = in_header['yllcorner'] + in_header['nrows'] * in_header['cellsize']
+            in_rows, band_slice = cell_index(-y, -in_top, in_header['cellsize'], in_header['nrows'])
+            if cols is None or band_slice is None:
+                continue
+            # window of the input raster under this part of the band
+            in_rows, in_cols_part = in_rows[band_slice], in_cols[cols]
+            window = geotiff.read_geotiff_window(tif_filename, tags, in_rows[0], in_cols_part[0],
+                                                 in_rows[-1] - in_rows[0] + 1, in_cols_part[-1] - in_cols_part[0] + 1)
+            values = window[np.ix_(in_rows - in_rows[0], in_cols_part - in_cols_part[0])]
+            merged = band[band_slice, cols]
+            valid = ~np.isnan(values)
+            if method == 'FIRST':
+                valid &= np.isnan(merged)
+            elif method in ['MIN', 'MAX']:
+                values = (np.fmin if method == 'MIN' else np.fmax)(merged, values)
+            elif method == 'MEAN':
+                values = np.where(np.isnan(merged), 0, merged) + values
+                count[band_slice, cols][valid] += 1
+            merged[valid] = values[valid]
+        if method == 'MEAN':
+            band /= np.maximum(count, 1)
+        band[np.isnan(band)] = header['NODATA_value']
+        yield band
+
+
+def mosaic(input_filenames, merged_filename, cellsize, snap_header=None, method='FIRST'):
+    """Merges GeoTIFF rasters to a new GeoTIFF on the snap raster grid, one band of rows at a time"""
+    if method not in ['FIRST', 'LAST', 'MEAN', 'MIN', 'MAX']:
+        raise ValueError(f'Unknown mosaic method {method}')
+    inputs = []
+    for input_filename in input_filenames:
+        tags = geotiff.read_tags(input_filename)
+        # stops on a compression or sample format the reader does not support, before anything is written
+        geotiff.tiff_dtype(tags, input_filename)
+        inputs.append((input_filename, tags, geotiff.read_georef(input_filename)))
+    header = mosaic_header([in_header for input_filename, tags, in_header in inputs], cellsize, snap_header)
+    # written under a temporary name and then renamed, so a failed merge does not leave a merged file behind
+    part_filename = merged_filename + '.part'
+    geotiff.write_geotiff_bands(part_filename, mosaic_bands(inputs, header, method, band_rows), header,
+                                tile_size=band_rows, geokeys=geotiff.read_geo_keys(inputs[0][1]))
+    os.replace(part_filename, merged_filename)
+    return merged_filename
+
+
+def merge_hydraulic_rasters(par, q, snap_header=None):
     # hydraulic raster filename and merged raster filename
     filename = f'{par}{q:06d}.tif'
     merged = f'{source_folder}\\LYR17_{par_folder_dict[par]}\\0_Merged\\{mannings_res_dict[mr]}'
@@ -48,13 +136,17 @@ def merge_hydraulic_rasters():
         eddpd = f'{source_folder}\\LYR17_{par_folder_dict[par]}\\1_EDDPD\\{mannings_res_dict[mr]}\\{filename}'
         dpdmry = f'{source_folder}\\LYR17_{par_folder_dict[par]}\\2_DPDMRY\\{mannings_res_dict[mr]}\\{filename}'
         mryfr = f'{source_folder}\\LYR17_{par_folder_dict[par]}\\3_MRYFR\\{mannings_res_dict[mr]}\\{filename}'
+        missing = [reach_filename for reach_filename in [eddpd, dpdmry, mryfr] if not os.path.exists(reach_filename)]
+        if missing:
+            logging.info(f'Missing hydraulic TIFF files {missing}, skipping {q} cfs merge.\n')
+            return None
 
         # if subfolder doesn't exist, creates one
         if not os.path.exists(merged):
-            os.makedirs(merged)
+            os.makedirs(merged, exist_ok=True)
             logging.info(f'Created {merged} folder.')
 
-        # set cell size for Mosaic To New Raster
+        # set cell size for mosaic
         logging.info(f'Determining cell size for raster merge...')
         res_10ft = (1, 3, 5)
         if mr in res_10ft:
@@ -64,27 +156,37 @@ def merge_hydraulic_rasters():
             cellsize = 3
             logging.info(f'Cell size set to {cellsize} ft\n')
 
-        # Process: Mosaic To New Raster (Mosaic To New Raster) (management)
         logging.info(f'Merging: {eddpd} \n'
                      f'                                                             {dpdmry}\n'
                      f'                                                             {mryfr}\n')
-        merged_ras = arcpy.management.MosaicToNewRaster(input_rasters=[eddpd, dpdmry, mryfr],
-                                                        output_location=merged,
-                                                        raster_dataset_name_with_extension=filename,
-                                                        coordinate_system_for_the_raster="",
-                                                        pixel_type="32_BIT_FLOAT", cellsize=cellsize,
-                                                        number_of_bands=1, mosaic_method="FIRST",
-                                                        mosaic_colormap_mode="FIRST")[0]
-        merged_ras = arcpy.Raster(merged_ras)
+        merged_ras = mosaic([eddpd, dpdmry, mryfr], merged_filename, cellsize, snap_header, mosaic_method)
         logging.info(f'Merged {par_folder_dict[par]} rasters: {merged_ras}\n')
+        return merged_ras
 
 if __name__ == '__main__':
-    # iterate through parameters (velocity, depth, WSE, BSS)
+    # georeferencing of the snap raster the merged rasters are aligned to
+    if os.path.exists(snap_raster):
+        snap_header = geotiff.read_georef(snap_raster)
+    else:
+        logging.warning(f'Snap raster {snap_raster} not found, merged rasters are aligned to the first reach raster grid')
+        snap_header = None
+
+    # check every reach raster can be read before merging any (a ValueError here names the first unsupported file)
     for par in par_ras_dict.values():
-        # iterate through discharge list
         for q in discharges:
+            for reach_folder in ['1_EDDPD', '2_DPDMRY', '3_MRYFR']:
+                reach_filename = (f'{source_folder}\\LYR17_{par_folder_dict[par]}\\{reach_folder}\\'
+                                  f'{mannings_res_dict[mr]}\\{par}{q:06d}.tif')
+                if os.path.exists(reach_filename):
+                    geotiff.tiff_dtype(geotiff.read_tags(reach_filename), reach_filename)
+
+    # merge each parameter (velocity, depth, WSE, BSS) and discharge on a pool of worker processes
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(merge_hydraulic_rasters, par, q, snap_header): (par, q)
+                   for par in par_ras_dict.values() for q in discharges}
+        for future in as_completed(futures):
+            par, q = futures[future]
             try:
-                merge_hydraulic_rasters()
-            except:
-                logging.info(f'Missing hydraulic TIFF files, skipping {q} cfs merge.\n')
-                pass
+                future.result()
+            except Exception as e:
+                logging.info(f'Could not merge {par} rasters ({e}), skipping {q} cfs merge.\n')
@@ -0,0 +1,181 @@
+# Keeps a SQLite catalog of the TUFLOW output files under a results folder (path, size, modified time and the fields of
+# reach_discharge_runid_res_par_hh_mm grid filenames), so scripts can query it instead of walking the results tree
+# The catalog is refreshed incrementally: only folders whose modified time changed since the last refresh are listed again
+# Keep this file next to the post-processing scripts that import it
+
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import logging
+
+# logging format
+FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+# SET THE RESULTS FOLDER TO CATALOG HERE (when run as a script)
+# example: 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\results'
+results_folder = 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\results'
+# SQLite catalog file (None = a catalog for this folder on the local disk, see results_catalog.default_db)
+catalog_db = None
+
+# TUFLOW grid output filenames: reach_discharge_runid_res_par_hh_mm.ext
+OUTPUT_NAME = re.compile(r'^(?P<reach>[^_]+)_(?P<discharge>\d+)_(?P<run_id>[^_]+)_(?P<res>[^_]+)_(?P<par>[^_]+)_'
+                         r'(?P<hh>\d+)_(?P<mm>\d+)\.(?P<ext>\w+)$')
+OUTPUT_COLUMNS = ['path', 'folder', 'name', 'ext', 'size', 'mtime', 'reach', 'discharge', 'run_id', 'res', 'par',
+                  'time', 'run_dir', 'mannings_res']
+
+
+def default_db(results_folder):
+    """Returns the default catalog file of a results folder, on the local disk (%LOCALAPPDATA%, or the home folder)
+    SQLite locking is not reliable on network shares, and the catalog is opened by several scripts at once"""
+    results_folder = os.path.abspath(results_folder)
+    catalog_folder = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'TUFLOW_results_catalogs')
+    os.makedirs(catalog_folder, exist_ok=True)
+    folder_hash = hashlib.sha1(results_folder.lower().encode()).hexdigest()[:10]
+    return os.path.join(catalog_folder, f'{os.path.basename(results_folder)}_{folder_hash}.sqlite')
+
+
+def open_catalog(db_path):
+    """Opens (creates if needed) a results catalog"""
+    con = sqlite3.connect(db_path)
+    con.execute('CREATE TABLE IF NOT EXISTS outputs (path TEXT PRIMARY KEY, folder TEXT, name TEXT, ext TEXT, size INTEGER, '
+                'mtime REAL, reach TEXT, discharge INTEGER, run_id TEXT, res TEXT, par TEXT, time REAL, run_dir TEXT, '
+                'mannings_res TEXT)')
+    con.execute('CREATE INDEX IF NOT EXISTS outputs_folder ON outputs (folder)')
+    con.execute('CREATE INDEX IF NOT EXISTS outputs_run ON outputs (run_dir, ext, time)')
+    con.execute('CREATE INDEX IF NOT EXISTS outputs_fields ON outputs (run_id, mannings_res, par)')
+    # folders with their modified time and subfolders when last listed
+    con.execute('CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT)')
+    return con
+
+
+def parse_output(path, size, mtime):
+    """Returns the catalog row of an output file (filename fields are None if it is not a reach_discharge_... grid)"""
+    folder, name = os.path.split(path)
+    ext = os.path.splitext(name)[1].lstrip('.').lower()
+    match = OUTPUT_NAME.match(name)
+    if not match:
+        return (path, folder, name, ext, size, mtime) + (None,) * 8
+    fields = match.groupdict()
+    # run folder (mannings_res_flow) is the folder below the runID folder, e.g. results\\171\\Combinedn_10ft_1000\\grids
+    parts = folder.split(os.sep)
+    if fields['run_id'] in parts[:-1]:
+        i = len(parts) - 1 - parts[::-1].index(fields['run_id'], 1)
+        run_dir = os.sep.join(parts[:i + 2])
+    else:
+        run_dir = os.path.dirname(folder) if os.path.basename(folder).lower() == 'grids' else folder
+    mannings_res = '_'.join(os.path.basename(run_dir).split('_')[:2])
+    # output time as written in the filename (hh_mm as hh.mm, as time_final_output)
+    output_time = float(fields['hh'] + '.' + fields['mm'])
+    return (path, folder, name, ext, size, mtime, fields['reach'], int(fields['discharge']), fields['run_id'],
+            fields['res'], fields['par'], output_time, run_dir, mannings_res)
+
+
+def under(column, folder):
+    """Returns the SQL condition and parameters for a path column being the folder or inside it"""
+    prefix = folder.rstrip(os.sep) + os.sep
+    return f'({column} = ? OR substr({column}, 1, ?) = ?)', [folder.rstrip(os.sep), len(prefix), prefix]
+
+
+def update_catalog(con, results_folder, full=False):
+    """Refreshes the catalog of a results folder, listing only the folders that changed since the last refresh
+    (full=True lists every folder again, to pick up files rewritten in place)
+    Returns the number of folders listed"""
+    results_folder = os.path.abspath(results_folder)
+    # the catalog file itself (and its journal) is left out if it is kept in the results folder
+    db_path = con.execute('PRAGMA database_list').fetchone()[2]
+    db_files = {db_path + suffix for suffix in ['', '-journal', '-wal', '-shm']} if db_path else set()
+    condition, params = under('path', results_folder)
+    folders = {path: (mtime, subdirs) for path, mtime, subdirs
+               in con.execute(f'SELECT path, mtime, subdirs FROM folders WHERE {condition}', params)}
+    now = time.time()
+    seen = set()
+    listed = 0
+    stack = [results_folder]
+    with con:
+        while stack:
+            folder = stack.pop()
+            try:
+                mtime = os.stat(folder).st_mtime
+            except OSError:
+                continue
+            seen.add(folder)
+            if not full and folder in folders and folders[folder][0] == mtime:
+                subdirs = folders[folder][1].split('|') if folders[folder][1] else []
+            else:
+                subdirs = []
+                rows = []
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                        elif entry.is_file() and os.path.abspath(entry.path) not in db_files:
+                            stat = entry.stat()
+                            rows.append(parse_output(entry.path, stat.st_size, stat.st_mtime))
+                con.execute('DELETE FROM outputs WHERE folder = ?', (folder,))
+                con.executemany(f'INSERT INTO outputs VALUES ({", ".join("?" * len(OUTPUT_COLUMNS))})', rows)
+                # a folder modified in the last few seconds may still be written to, so it is listed again next time
+                con.execute('INSERT OR REPLACE INTO folders VALUES (?, ?, ?)',
+                            (folder, mtime if now - mtime > 5 else None, '|'.join(subdirs)))
+                listed += 1
+            stack.extend(os.path.join(folder, subdir) for subdir in subdirs)
+
+        # forget folders that no longer exist
+        gone = [(folder,) for folder in folders if folder not in seen]
+        con.executemany('DELETE FROM outputs WHERE folder = ?', gone)
+        con.executemany('DELETE FROM folders WHERE path = ?', gone)
+    return listed
+
+
+def query_outputs(con, results_folder=None, **fields):
+    """Returns the catalog rows (as dicts) of the output files matching the given fields, e.g. run_id='171', par='d'"""
+    conditions, params = fields_condition(results_folder, fields)
+    cursor = con.execute(f'SELECT {", ".join(OUTPUT_COLUMNS)} FROM outputs WHERE {conditions} ORDER BY path', params)
+    return [dict(zip(OUTPUT_COLUMNS, row)) for row in cursor]
+
+
+def final_outputs(con, results_folder=None, ext='flt', whole_hours=True, **fields):
+    """Returns (run folder, path) of the grids at the final output time of each run matching the given fields
+    (the final time is the highest time among the run's grids, whole hours only as the hh_00.flt files used before)"""
+    conditions, params = fields_condition(results_folder, dict(fields, ext=ext))
+    hours = 'AND time = ROUND(time)' if whole_hours else ''
+    cursor = con.execute(f'SELECT run_dir, path FROM outputs o WHERE {conditions} {hours} AND time = '
+                         f'(SELECT MAX(time) FROM outputs WHERE run_dir = o.run_dir AND ext = o.ext {hours}) '
+                         f'ORDER BY run_dir, path', params)
+    return cursor.fetchall()
+
+
+def fields_condition(results_folder, fields):
+    """Returns the SQL condition and parameters for output files under a folder with the given field values"""
+    conditions = ['1']
+    params = []
+    if results_folder:
+        condition, params = under('path', os.path.abspath(results_folder))
+        conditions.append(condition)
+    for field, value in fields.items():
+        if field not in OUTPUT_COLUMNS:
+            raise ValueError(f'{field} is not a results catalog field ({", ".join(OUTPUT_COLUMNS)})')
+        if value is not None:
+            conditions.append(f'{field} = ?')
+            params.append(value)
+    return ' AND '.join(conditions), params
+
+
+def catalog(results_folder, db_path=None, full=False):
+    """Opens the catalog of a results folder (default file on the local disk, see default_db) and refreshes it"""
+    db_path = db_path or default_db(results_folder)
+    con = open_catalog(db_path)
+    start = time.time()
+    listed = update_catalog(con, results_folder, full)
+    logging.info(f'Results catalog {db_path}: listed {listed} changed folders in {time.time() - start:.1f} s')
+    return con
+
+
+if __name__ == "__main__":
+    con = catalog(results_folder, catalog_db, full=False)
+    for run_id, n_runs, n_files in con.execute('SELECT run_id, COUNT(DISTINCT run_dir), COUNT(*) FROM outputs '
+                                                'WHERE run_id IS NOT NULL GROUP BY run_id ORDER BY run_id'):
+        logging.info(f'runID {run_id}: {n_runs} runs, {n_files} grid files')
+    con.close()
@@ -2,20 +2,35 @@
 # Created by SJP, last updated 06/24/21
 
 import os
-import arcpy
+import time
+import shutil
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import flt_io
+import results_catalog
+from geotiff import flt_to_tif, read_georef
 
 # SET THE TUFLOW RESULTS FOLDER HERE
 # example: 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\results\\110'
 source_folder = 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\results\\171'
+# results catalog of the float files (None = a catalog for this folder on the local disk, see results_catalog.default_db)
+catalog_db = None
+# local folder to copy the float files to and convert them in before the TIFFs are copied to the hydraulics folder
+# (None = convert straight from the results folder to the hydraulics folder)
+# example: 'D:\\LYR_Restore\\staging'
+staging_folder = None
 
 
 # DO NOT CHANGE SCRIPT BELOW UNLESS YOU KNOW WHAT YOU ARE DOING
-# Set workspace file for ArcGIS, enable overwriting, and retrieve Spatial Analyst extension license
-arcpy.env.workspace = os.path.abspath('')
-arcpy.env.overwriteOutput = True
-arcpy.CheckOutExtension('Spatial')
-arcpy.env.snapRaster = 'Z:\\LYR\\LYR_2017studies\\LYR17_Topo\\LYR17_DEM\\09-Final_2017_DEM\\With_Structures\\LYR17_Final_DEM_with_str_adjusted.tif'
+# snap raster (DEM) the converted rasters are checked against, the cells of the float files are written as they are
+snap_raster = 'Z:\\LYR\\LYR_2017studies\\LYR17_Topo\\LYR17_DEM\\09-Final_2017_DEM\\With_Structures\\LYR17_Final_DEM_with_str_adjusted.tif'
+# projection EPSG code for the GeoTIFFs (None = use the .prj written by TUFLOW next to each float file)
+epsg = None
+# number of float files converted at once (processes) and copied to or from the server at once (threads)
+workers = 4
+copy_threads = 8
+# number of times a failed copy or conversion is tried again
+retries = 2
 
 # logging format
 FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
@@ -53,53 +68,126 @@ def get_dest(flt_filename):
         return os.path.join(dest_folder, dest_tif)
 
 
-def float_to_raster(flt_filename, *args, **kwargs):
-    """Converts input float raster to geoTIFF"""
-    flt_raster = arcpy.Raster(flt_filename)
+def transfer_dest(flt_filename):
+    """Returns the TIFF the float raster is transferred to, or None if it is skipped"""
     tif_filename = get_dest(flt_filename)
     if tif_filename is None:
-        logging.info(f'Skipping {flt_filename}...\n')
+        logging.info(f'Skipping {flt_filename}...')
         return None
     if os.path.exists(tif_filename):
-        logging.info(f'TIFF file exists, skipping {flt_filename}...\n')
+        logging.info(f'TIFF file exists, skipping {flt_filename}...')
         return None
-    else:
-        logging.info(f'Converting from float to TIFF: \n>>> {flt_filename}...')
-        arcpy.FloatToRaster_conversion(flt_raster, tif_filename)
-        logging.info(f'Saved TIFF file to: \n>>> {tif_filename}\n')
-        return tif_filename
-
-
-def time_final_output(files):
-    """Returns the highest domain time among float files"""
-    # get time part from file strings
-    time_strs = [f.replace('.flt', '').split('_')[-2:] for f in files]
-    # convert to float
-    times = [float(t[0] + '.' + t[1]) for t in time_strs]
-    max_time = max(times)
-    max_str = ('%06.2f' % max_time).replace('.', '_')
-    return max_str
+    return tif_filename
+
+
+def retry(func, *args):
+    """Calls func(*args), trying again after a pause (up to the number of retries) if it fails"""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logging.info(f'{func.__name__} failed ({e}), trying again...')
+            time.sleep(2 ** attempt)
+
+
+def fetch_flt(flt_filename, stage_dir):
+    """Copies a float raster (.flt, .hdr and .prj) to a local staging folder and returns the local .flt"""
+    os.makedirs(stage_dir, exist_ok=True)
+    for ext in ['.flt', '.hdr', '.prj']:
+        source = os.path.splitext(flt_filename)[0] + ext
+        if os.path.exists(source):
+            shutil.copyfile(source, os.path.join(stage_dir, os.path.basename(source)))
+    return os.path.join(stage_dir, os.path.basename(flt_filename))
+
+
+def convert_flt(flt_filename, tif_filename, snap_header=None):
+    """Converts a float raster to geoTIFF (run in the process pool) and returns the TIFF"""
+    if snap_header and not flt_io.is_aligned(flt_io.read_hdr(flt_filename), snap_header):
+        logging.info(f'WARNING: {flt_filename} cells are not aligned with the snap raster {snap_raster}')
+    return flt_to_tif(flt_filename, tif_filename, epsg=epsg)
+
+
+def store_tif(tif_filename, dest_filename):
+    """Puts a converted TIFF in place, copied under a temporary name and then renamed so it is never left half written"""
+    part_filename = dest_filename + '.part'
+    if tif_filename != part_filename:
+        shutil.copyfile(tif_filename, part_filename)
+    os.replace(part_filename, dest_filename)
+    return dest_filename
+
+
+def transfer_rasters(transfers, snap_header=None):
+    """Converts and transfers a list of (float raster, TIFF) with copies on a thread pool and conversions on a process pool
+    Returns the TIFFs saved and the float rasters that failed"""
+    sizes = [os.path.getsize(flt_filename) / 2 ** 20 for flt_filename, tif_filename in transfers]
+    saved = []
+    failed = []
+    saved_mb = 0
+    start = time.time()
+    waiting = list(range(len(transfers)))[::-1]
+    # future: (step, transfer index) for the rasters in the pipeline
+    pending = {}
+    with ThreadPoolExecutor(copy_threads) as copy_pool, ProcessPoolExecutor(workers) as convert_pool:
+        while waiting or pending:
+            # keep a bounded number of rasters in the pipeline (staged float files take up local disk)
+            while waiting and len(pending) < 2 * workers:
+                i = waiting.pop()
+                flt_filename, tif_filename = transfers[i]
+                if staging_folder:
+                    future = copy_pool.submit(retry, fetch_flt, flt_filename, os.path.join(staging_folder, str(i)))
+                    pending[future] = ('copy from server', i)
+                else:
+                    future = convert_pool.submit(retry, convert_flt, flt_filename, tif_filename + '.part', snap_header)
+                    pending[future] = ('convert', i)
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step, i = pending.pop(future)
+                flt_filename, tif_filename = transfers[i]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.info(f'FAILED to {step} {flt_filename}: {e}')
+                    failed.append(flt_filename)
+                    result = None
+                if result and step == 'copy from server':
+                    local_tif = os.path.splitext(result)[0] + '.tif'
+                    pending[convert_pool.submit(retry, convert_flt, result, local_tif, snap_header)] = ('convert', i)
+                elif result and step == 'convert':
+                    pending[copy_pool.submit(retry, store_tif, result, tif_filename)] = ('copy to server', i)
+                else:
+                    if result:
+                        saved.append(result)
+                        saved_mb += sizes[i]
+                        logging.info(f'[{len(saved) + len(failed)}/{len(transfers)}] Saved TIFF file to: {result} '
+                                     f'({saved_mb / (time.time() - start):.1f} MB/s)')
+                    if staging_folder:
+                        shutil.rmtree(os.path.join(staging_folder, str(i)), ignore_errors=True)
+
+    elapsed = time.time() - start
+    logging.info(f'Transferred {len(saved)} of {len(transfers)} float rasters ({saved_mb:.0f} MB) in {elapsed:.0f} s '
+                 f'({saved_mb / max(elapsed, 1e-6):.1f} MB/s), {len(failed)} failed')
+    return saved, failed
 
 
 if __name__ == "__main__":
-
-    # get top-level subdirs of results folder for each run
-    run_dirs = [os.path.join(source_folder, subdir) for subdir in os.listdir(source_folder) if os.path.isdir(os.path.join(source_folder, subdir))]
-    # iterate over runs
-    for run_dir in run_dirs:
-        # make list of float files ending in 00.flt
-        flt_files = []
-        for dir, subdirs, files in os.walk(run_dir):
-            for flt_file in files:
-                if flt_file.endswith('00.flt'):
-                    flt_filename = os.path.join(dir, flt_file)  # path of float file in results folder
-                    flt_files.append(flt_filename)
-
-        # get last raster output time as string
-        max_time = time_final_output(flt_files)
-        # list of all float rasters at final time for the run
-        end_files = [f for f in flt_files if f.endswith(f'{max_time}.flt')]
-
-        # transfer .flt in source folder to .tif in target folder
-        for end_file in end_files:
-            float_to_raster(end_file)
+    # georeferencing of the snap raster, to check the float files line up with it
+    snap_header = read_georef(snap_raster) if os.path.exists(snap_raster) else None
+
+    # refresh the results catalog (only folders changed since the last run are listed)
+    con = results_catalog.catalog(source_folder, catalog_db)
+    # float rasters at the final output time of each run
+    end_files = [path for run_dir, path in results_catalog.final_outputs(con, source_folder)]
+    con.close()
+
+    # transfer .flt in source folder to .tif in target folder
+    transfers = []
+    for end_file in end_files:
+        tif_filename = transfer_dest(end_file)
+        if tif_filename:
+            transfers.append((end_file, tif_filename))
+    saved, failed = transfer_rasters(transfers, snap_header)
+    for flt_filename in failed:
+        logging.info(f'NOT TRANSFERRED: {flt_filename}')
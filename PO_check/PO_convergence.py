@@ -1,15 +1,23 @@
 # Python script for checking velocity and discharge convergence from the _PO.csv generated by TUFLOW
 # Last updated on 12/04/2020 by SJP and KGL
 
-# Step 1 - copy this script for use into your review folder
-# Step 2 - set the ..\\results\\runID folder and the ..\\review\\runID folder
+# Step 1 - copy this script (and review_utils.py from the top-level scripts folder) for use into your review folder
+# Step 2 - set the ..\\results\\runID folder and the ..\\review\\runID folder (and the number of worker processes)
 # Step 3 - check the files in the folder created (PO convergence times, criteria, and plots)
 
 import os
+import sys
+import json
 import shutil
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+
+# shared rolling window statistics and plotting (review_utils.py in this folder or the top-level scripts folder)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from review_utils import rolling_slopes, sliding_extreme, plot_series, plot_job, render_plots
 
 import logging
 FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
@@ -20,58 +28,183 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 results_folder = 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\results\\133'
 # example: 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\review'
 review_folder = 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\review'
+# number of discharges reviewed in parallel (1 = one after another)
+workers = 4
+# save a .png plot of each PO (False for a numbers-only review)
+make_plots = True
+# save each parsed PO file as a binary .npy cache (memory-mapped by later reviews of the same file)
+cache_po = False
+# SENSITIVITY SWEEP - set to a grid of criteria values to calculate the convergence time of every PO for every
+# combination in one pass (saved to _PO_sensitivity.csv instead of the normal review), for example:
+# sweep_grid = {'check_lengths': [30, 60, 120], 'tolerances_V': [0.001, 0.005], 'tolerances_Q': [0.001, 0.005],
+#               'slope_thrs_V': [0.5, 1], 'slope_thrs_Q': [0.5, 1]}
+sweep_grid = None
+
+# FOLLOW MODE - set to the _PO.csv of a running simulation to check convergence as TUFLOW writes it
+# (instead of reviewing the results folder)
+# example: 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\results\\110\\...\\..._PO.csv'
+follow_po = None
+# seconds between checks of the followed PO file
+poll_interval = 60
+# stop following if the PO file has not grown for this many seconds (simulation finished or stopped)
+stale_timeout = 3600
+
+# CONVERGENCE CRITERIA
+# number of values to check back for convergence
+check_length = 60
+# error tolerance (fractional difference) for velocity
+tolerance_V = 0.001
+# error tolerance (fractional difference) for discharge
+tolerance_Q = 0.001
+# slope threshold for linear regression line [velocity/time] (only used with check_slopes)
+slope_thr_V = 1
+# slope threshold for linear regression line [discharge/time] (only used with check_slopes)
+slope_thr_Q = 1
+
+
+# statistics of the previous check_length values at each timestep i >= check_length for every PO column of vals
+# (2D array, rows = timesteps): whether timestep i can be checked (a zero value at i or anywhere in the previous
+# check_length values skips timestep i), the largest fractional difference between the value at i and the previous
+# values, and the regression slope of the previous values (only calculated with check_slopes)
+# returns None if there are no more than check_length timesteps
+def window_stats(t, vals, check_length, check_slopes=False):
+    n, m = vals.shape
+    if n <= check_length:
+        return None
+    n_checks = n - check_length
+    current = vals[check_length:]
+
+    # max and min of the previous check_length values at each timestep
+    win_max = sliding_extreme(vals, check_length, np.maximum)[:n_checks]
+    win_min = sliding_extreme(vals, check_length, np.minimum)[:n_checks]
+
+    # number of zero values among the previous check_length values at each timestep
+    zero_count = np.zeros((n + 1, m), dtype=np.int64)
+    np.cumsum(vals == 0, axis=0, out=zero_count[1:])
+    win_zeros = zero_count[check_length:n] - zero_count[:n_checks]
+    valid = (current != 0) & (win_zeros == 0)
+
+    # the largest fractional difference is always to the window max or min
+    with np.errstate(divide='ignore', invalid='ignore'):
+        max_diff = np.maximum(np.abs(current - win_min), np.abs(win_max - current)) / np.abs(current)
 
-
-def convergence_check(po_filename, check_slopes=False, *args, **kwargs):
-    # number of values to check back for convergence
-    check_length = 60
-    # error tolerance (fractional difference) for velocity
-    tolerance_V = 0.001
-    # error tolerance (fractional difference) for discharge
-    tolerance_Q = 0.001
     if check_slopes:
-        # slope threshold for linear regression line [velocity/time]
-        slope_thr_V = 1
-        # slope threshold for linear regression line [discharge/time]
-        slope_thr_Q = 1
+        # slope of the linear regression line over the check_length values before each timestep
+        slopes = rolling_slopes(t, vals, check_length)[:n_checks]
     else:
-        slope_thr_V = np.nan
-        slope_thr_Q = np.nan
+        slopes = np.zeros_like(current)
+    return {'check_length': check_length, 'valid': valid, 'max_diff': max_diff, 'slopes': slopes}
 
-    # flatten array function (used to calculate max convergence times below)
-    flatten = lambda l: [val[0] for val in l]
 
-    # get header PO names
-    with open(po_filename) as f:
-        lines = f.readlines()
-        if lines:
-            header = lines[1]
-            header = header.replace("\"", "").replace("\n", "").split(',')[1:]
-        else:
-            logging.info(f'WARNING: Skipping blank PO file: {po_filename}')
-            return
+# find the first converged timestep for every PO column from its window_stats: the previous check_length values all
+# lie within tolerance (fractional difference) of the value at i and their regression slope meets the slope threshold
+# returns the row index of the convergence time for each column (-1 if does not converge) and the max fractional
+# difference at the last timestep (nan if the last timestep was skipped)
+def first_converged(stats, tolerances, slope_thrs):
+    if stats is None:
+        return np.full(len(tolerances), -1), np.full(len(tolerances), np.nan)
+    valid, max_diff = stats['valid'], stats['max_diff']
+    converged = valid & (max_diff <= tolerances) & ~(np.abs(stats['slopes']) > slope_thrs)
+    conv_idx = np.where(converged.any(axis=0), converged.argmax(axis=0) + stats['check_length'], -1)
+    last_diff = np.where(valid[-1], max_diff[-1], np.nan)
+    return conv_idx, last_diff
 
-    # parse PO csv to dataframe
-    df = pd.read_csv(po_filename, header=None, skiprows=3)
-    df = df.drop(0, axis=1)
-    df.columns = header
-    pos = header[1:]
 
-    # iterate over PO and plot/save to .png
-    for po in pos:
-        plt.clf()
-        x = df.Time
-        plt.xlabel('Time (hrs)', fontsize=12)
-        y = df[po]
-        plt.plot(x, y)
-        plt.title(po)
-
-        if po.startswith('Pt'):
-            plt.ylabel('Velocity (ft/s)', fontsize=12)
+# find the first converged timestep for every PO column of vals (see window_stats and first_converged)
+def window_convergence(t, vals, check_length, tolerances, slope_thrs, check_slopes=False):
+    return first_converged(window_stats(t, vals, check_length, check_slopes), tolerances, slope_thrs)
+
+
+# error tolerance and slope threshold for each PO column (velocity for 'Pt', discharge for 'Ln')
+# (slope thresholds of nan skip the slope check)
+def po_criteria(pos, tolerance_V, tolerance_Q, slope_thr_V=np.nan, slope_thr_Q=np.nan):
+    tolerances = np.array([tolerance_V if po.startswith('Pt') else tolerance_Q for po in pos], dtype=float)
+    slope_thrs = np.array([slope_thr_V if po.startswith('Pt') else slope_thr_Q for po in pos], dtype=float)
+    return tolerances, slope_thrs
+
+
+# create text file recording the check length, error tolerances and slope thresholds (if slopes were checked)
+def write_criteria(text_path, check_length, tolerance_V, tolerance_Q, slope_thr_V=None, slope_thr_Q=None):
+    f = open(text_path, 'w+')
+    f.write('\ncheck length = previous %i values were checked' % (check_length))
+    f.write('\nerror tolerance for velocity = %.4f%%' % (tolerance_V * 100))
+    if slope_thr_V is not None:
+        f.write('\nslope threshold for velocity = %.4f' % (slope_thr_V))
+    f.write('\nerror tolerance for discharge = %.4f%%' % (tolerance_Q * 100))
+    if slope_thr_Q is not None:
+        f.write('\nslope threshold for discharge = %.4f' % (slope_thr_Q))
+    f.close()
+
+
+# convergence time (or 'DNC' / 'DNC: x% max diff') of each PO from first_converged results
+def convergence_labels(pos, t, conv_idx, max_diffs):
+    labels = {}
+    for j, po in enumerate(pos):
+        if conv_idx[j] >= 0:
+            labels[po] = t[conv_idx[j]]
+        # if no timestep converged, save amount still fluctuating at the last timestep
+        elif not np.isnan(max_diffs[j]):
+            labels[po] = f'DNC: {max_diffs[j] * 100:.2f}% max diff'
         else:
-            plt.ylabel('Discharge (cfs)', fontsize=12)
+            labels[po] = 'DNC'
+    return labels
+
+
+# read a TUFLOW _PO.csv in one pass: PO names from the header (line 2), then the data rows from line 4
+# only the POs named in columns are loaded (all POs if None) and their values are returned as dtype (compact float32
+# by default), time is always float64
+# with use_cache, the parsed file is saved as a .npy (one row per column) next to the csv, keyed on the size and modified
+# time of the csv in a _cache.json, and later reads memory-map it and return the requested columns as views
+# returns the PO names, the time column and the PO values (rows = timesteps)
+def read_po_csv(po_filename, columns=None, dtype=np.float32, use_cache=False):
+    cache_path = po_filename.replace('.csv', '_cache.npy')
+    key_path = po_filename.replace('.csv', '_cache.json')
+    stat = os.stat(po_filename)
+    key = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    cache_key = {}
+    if use_cache and os.path.exists(cache_path) and os.path.exists(key_path):
+        with open(key_path) as f:
+            cache_key = json.load(f)
+
+    if cache_key.get('size') == key['size'] and cache_key.get('mtime') == key['mtime']:
+        data = np.load(cache_path, mmap_mode='r')
+        all_names = cache_key['names']
+    else:
+        with open(po_filename) as f:
+            f.readline()
+            header_names = f.readline().replace("\"", "").replace("\n", "").split(',')[2:]
+            f.readline()
+            # the cache holds every PO, otherwise only parse the time and requested PO columns
+            all_names = header_names if use_cache or columns is None else [po for po in header_names if po in columns]
+            usecols = [1] + [2 + header_names.index(po) for po in all_names]
+            data = np.loadtxt(f, delimiter=',', usecols=usecols, dtype=np.float64, ndmin=2).T
+        if use_cache:
+            np.save(cache_path, np.ascontiguousarray(data))
+            # the key is written last, so a cache left half written is never used
+            with open(key_path, 'w') as f:
+                json.dump(dict(key, names=all_names), f)
+
+    names = all_names if columns is None else [po for po in all_names if po in columns]
+    rows = [1 + all_names.index(po) for po in names]
+    # consecutive columns are a view of the (memory-mapped) data, others are copied
+    if rows and rows == list(range(rows[0], rows[-1] + 1)):
+        vals = data[rows[0]:rows[-1] + 1].T
+    else:
+        vals = data[rows].T
+    return names, np.asarray(data[0], dtype=np.float64), np.asarray(vals, dtype=dtype)
+
+
+# plots are rendered at the end of the check, or appended to plot_jobs (if given) to be rendered later with render_plots
+def convergence_check(po_filename, check_slopes=False, make_plots=True, plot_jobs=None, use_cache=False, *args, **kwargs):
+    # flatten array function (used to calculate max convergence times below)
+    flatten = lambda l: [val[0] for val in l]
 
-        plt.savefig(po_filename.replace('PO.csv', po + '.png'))
+    if os.path.getsize(po_filename) == 0:
+        logging.info(f'WARNING: Skipping blank PO file: {po_filename}')
+        return
+
+    # parse PO names, time and values (float64 so fractional differences match the values written by TUFLOW)
+    pos, t, vals = read_po_csv(po_filename, dtype=np.float64, use_cache=use_cache)
 
     # check that PO name convention begins with 'Pt' or 'Ln'
     for po in pos:
@@ -82,54 +215,16 @@ def convergence_check(po_filename, check_slopes=False, *args, **kwargs):
     # initialize convergence times dict ('DNC' = does not converge)
     convergence_time = {po: ['DNC'] for po in pos}
 
-    # iterate over po locations
-    for po in pos:
-        logging.info('checking %s...' % po)
-        if po.startswith('Pt'):
-            slope_thr = slope_thr_V
-            tolerance = tolerance_V
-        if po.startswith('Ln'):
-            slope_thr = slope_thr_Q
-            tolerance = tolerance_Q
-        # iterate down column
-        for i in range(check_length, len(df.Time)):
-            # collect last 20 values and check slope of linear regression line
-            t = df.Time[i - check_length: i]
-            vals = df[po][i - check_length: i]
-            if check_slopes:
-                slope, yint = np.polyfit(t, vals, deg=1)
-            else:
-                slope = 0
-            # calculate fractional differences between value at i previous values
-            frac_diffs = []
-            # if current check value is not 0
-            if df[po][i]:
-                # iterate over previous check_length values
-                for di in range(check_length):
-                    # if previous value in also not 0
-                    if df[po][i - check_length + di]:
-                        # calculate fractional difference between previous values and check value
-                        frac_diff = abs((df[po][i] - df[po][i - check_length + di]) / df[po][i])
-                        frac_diffs.append(frac_diff)
-                    # skip to next timestep if any df[po][i - check_length + di] == 0
-                    else:
-                        frac_diffs.append(np.nan)
-                        break
-            # skip to next timestep if df[po][i] == 0
-            else:
-                frac_diffs.append(np.nan)
-
-            if not np.nan in frac_diffs:
-                # check if previous check_val (e.g. 20) values are all within tolerance
-                if np.all(np.asarray(frac_diffs) <= tolerance):
-                    # check if slope of linear regression is within slope threshold
-                    if not abs(slope) > slope_thr:
-                        convergence_time[po] = [df.Time[i]]
-                        break
-            # if break didn't occur on last iteration, save amount still fluctuating
-            if i == len(df.Time) - 1:
-                if not np.nan in frac_diffs:
-                    convergence_time[po] = [f'DNC: {max(frac_diffs) * 100:.2f}% max diff']
+    if check_slopes:
+        tolerances, slope_thrs = po_criteria(pos, tolerance_V, tolerance_Q, slope_thr_V, slope_thr_Q)
+    else:
+        tolerances, slope_thrs = po_criteria(pos, tolerance_V, tolerance_Q)
+
+    # check all po locations at once
+    logging.info('checking %s...' % ', '.join(pos))
+    conv_idx, max_diffs = window_convergence(t, vals, check_length, tolerances, slope_thrs, check_slopes)
+    for po, label in convergence_labels(pos, t, conv_idx, max_diffs).items():
+        convergence_time[po] = [label]
 
     # make separate dataframes for monitoring points (for velocity) and lines (for discharge)
     pts = {i: v for i, v in convergence_time.items() if i.startswith('Pt')}
@@ -191,38 +286,237 @@ def convergence_check(po_filename, check_slopes=False, *args, **kwargs):
 
     # create text file recording the error tolerance and slope thresholds set
     text_path = conv_path.replace('.csv', '_convergence_criteria.txt')
-    f = open(text_path, 'w+')
-    f.write('\ncheck length = previous %i values were checked' % (check_length))
-    f.write('\nerror tolerance for velocity = %.4f%%' % (tolerance_V * 100))
-    if check_slopes:
-        f.write('\nslope threshold for velocity = %.4f' % (slope_thr_V))
-    f.write('\nerror tolerance for discharge = %.4f%%' % (tolerance_Q * 100))
     if check_slopes:
-        f.write('\nslope threshold for discharge = %.4f' % (slope_thr_Q))
-    f.close()
+        write_criteria(text_path, check_length, tolerance_V, tolerance_Q, slope_thr_V, slope_thr_Q)
+    else:
+        write_criteria(text_path, check_length, tolerance_V, tolerance_Q)
+
+    # plot each PO and save to .png
+    if make_plots:
+        jobs = [plot_job(po_filename.replace('PO.csv', po + '.png'), t, vals[:, j], po, 'Time (hrs)',
+                         'Velocity (ft/s)' if po.startswith('Pt') else 'Discharge (cfs)')
+                for j, po in enumerate(pos)]
+        if plot_jobs is None:
+            render_plots(jobs)
+        else:
+            plot_jobs.extend(jobs)
+
+    return conv_df
+
+
+# calculate the convergence time of every PO for every combination of the criteria values given, reading the PO file
+# once and sharing the window statistics of each check length between all tolerance/slope threshold combinations
+# (slopes are only checked if slope thresholds are given)
+# saves one table of the convergence time of each PO under each combination (_PO_sensitivity.csv) and a
+# _convergence_criteria.txt for each combination
+def convergence_sweep(po_filename, check_lengths, tolerances_V, tolerances_Q, slope_thrs_V=None, slope_thrs_Q=None,
+                      use_cache=False):
+    pos, t, vals = read_po_csv(po_filename, dtype=np.float64, use_cache=use_cache)
+    for po in pos:
+        if not (po.startswith('Pt') or po.startswith('Ln')):
+            raise SyntaxError(
+                "Name convention not satisfied for: %s.\nVelocity point observation names should begin with \'Pt\'\nDischarge line observations should begin with \'Ln\'" % po)
+
+    check_slopes = slope_thrs_V is not None and slope_thrs_Q is not None
+    slope_grid = list(itertools.product(slope_thrs_V, slope_thrs_Q)) if check_slopes else [(None, None)]
+
+    rows = []
+    combination = 0
+    for check_length in check_lengths:
+        logging.info('checking %s with check length %i...' % (', '.join(pos), check_length))
+        stats = window_stats(t, vals, check_length, check_slopes)
+        for tol_V, tol_Q, (thr_V, thr_Q) in itertools.product(tolerances_V, tolerances_Q, slope_grid):
+            combination += 1
+            if check_slopes:
+                tolerances, slope_thrs = po_criteria(pos, tol_V, tol_Q, thr_V, thr_Q)
+            else:
+                tolerances, slope_thrs = po_criteria(pos, tol_V, tol_Q)
+            conv_idx, max_diffs = first_converged(stats, tolerances, slope_thrs)
+            for po, label in convergence_labels(pos, t, conv_idx, max_diffs).items():
+                rows.append({'combination': combination, 'check length': check_length, 'tolerance V': tol_V,
+                             'tolerance Q': tol_Q, 'slope thr V': thr_V, 'slope thr Q': thr_Q, 'PO': po,
+                             'conv time': label})
+            write_criteria(po_filename.replace('.csv', '_sweep%i_convergence_criteria.txt' % combination),
+                           check_length, tol_V, tol_Q, thr_V, thr_Q)
+
+    sweep_df = pd.DataFrame(rows)
+    sweep_path = po_filename.replace('.csv', '_sensitivity.csv')
+    sweep_df.to_csv(sweep_path, index=False)
+    logging.info('\nsaved convergence sensitivity table (%i combinations): %s\n' % (combination, sweep_path))
+    return sweep_df
+
+
+# copy PO file to review/runID/discharge folder and run the convergence check, logging to a file in that folder
+# returns a summary row for the discharge and its deferred PO plots
+def review_po_file(source_path):
+    PO_file = os.path.basename(source_path)
+    run_id = PO_file.split('_')[2]
+    run_id_folder = os.path.join(review_folder, run_id)
+    discharge = PO_file.replace('_PO.csv', '')
+    discharge_folder = os.path.join(run_id_folder, discharge)
+    summary = {'run ID': run_id, 'discharge': discharge, 'V conv time': 'DNC', 'Q conv time': 'DNC', 'status': 'OK'}
+    plot_jobs = []
+
+    # create new folder for run ID and subfolder for discharge, if doesn't exist
+    os.makedirs(discharge_folder, exist_ok=True)
+    po_filename = os.path.join(discharge_folder, PO_file)  # path of PO file in review/runID/discharge folder
+
+    # send this discharge's log messages to its own file so parallel reviews don't interleave
+    log_handler = logging.FileHandler(po_filename.replace('.csv', '_review.log'), mode='w')
+    log_handler.setFormatter(logging.Formatter(FORMAT))
+    root_logger = logging.getLogger()
+    console_handlers = root_logger.handlers[:]
+    root_logger.handlers = [log_handler]
+    try:
+        # copied with its modified time (unless unchanged since the last review), so the parsed cache stays valid
+        source_stat = os.stat(source_path)
+        if os.path.exists(po_filename) and (os.path.getsize(po_filename), os.path.getmtime(po_filename)) == \
+                (source_stat.st_size, source_stat.st_mtime):
+            logging.info('PO.csv file is unchanged since the last review of {0}, not copied'.format(discharge))
+        else:
+            shutil.copy2(source_path, discharge_folder)
+            logging.info('PO.csv files have been copied from the results folder to discharge folder for {0}'.format(discharge))
+        # run convergence sweep (if a grid is set) or convergence check
+        if sweep_grid:
+            logging.info('Running convergence sweep for {0}'.format(discharge_folder))
+            sweep_df = convergence_sweep(po_filename, use_cache=cache_po, **sweep_grid)
+            summary['status'] = 'sweep: {0} combinations'.format(sweep_df['combination'].max())
+        else:
+            logging.info('Running convergence check function for {0}'.format(discharge_folder))
+            conv_df = convergence_check(po_filename, make_plots=make_plots, plot_jobs=plot_jobs, use_cache=cache_po)
+            if conv_df is None:
+                summary['status'] = 'blank PO file'
+            else:
+                summary['V conv time'] = conv_df['V conv time'][0]
+                summary['Q conv time'] = conv_df['Q conv time'][0]
+    except Exception as e:
+        logging.exception('Convergence check failed for {0}'.format(discharge))
+        summary['status'] = 'FAILED: {0}'.format(e)
+    finally:
+        root_logger.handlers = console_handlers
+        log_handler.close()
+    return summary, plot_jobs
+
+
+# print one summary for all discharges
+def log_summary(summaries):
+    if summaries:
+        summary_df = pd.DataFrame(summaries).sort_values(['run ID', 'discharge'], ignore_index=True)
+        logging.info('\nPO convergence summary:\n%s' % summary_df.to_string(index=False))
+
+
+# watch the _PO.csv of a running simulation and check convergence on the rows appended since the last poll
+# (only the last check_length rows are kept between polls), logging each PO as it converges
+# returns the convergence times once every PO has converged, or when the file stops growing for stale_timeout seconds
+def follow_po_file(po_filename, check_slopes=False):
+    offset = 0
+    pending = b''
+    header_lines = []
+    pos = []
+    t_buf = np.empty(0)
+    vals_buf = np.empty((0, 0))
+    convergence_time = {}
+    max_diffs = np.empty(0)
+    last_growth = time.time()
+
+    while True:
+        # the file may not be created yet if the simulation was started with the watcher
+        try:
+            with open(po_filename, 'rb') as f:
+                f.seek(offset)
+                new_data = f.read()
+        except FileNotFoundError:
+            new_data = b''
+        offset += len(new_data)
+        if new_data:
+            last_growth = time.time()
+        # only parse complete lines, keep any partly written line for the next poll
+        pending += new_data
+        complete, _, pending = pending.rpartition(b'\n')
+        lines = complete.decode().splitlines() if complete else []
+
+        # the first 3 lines are the header (PO names on line 2)
+        while lines and len(header_lines) < 3:
+            header_lines.append(lines.pop(0))
+            if len(header_lines) == 2:
+                pos = header_lines[1].replace("\"", "").split(',')[2:]
+                for po in pos:
+                    if not (po.startswith('Pt') or po.startswith('Ln')):
+                        raise SyntaxError(
+                            "Name convention not satisfied for: %s.\nVelocity point observation names should begin with \'Pt\'\nDischarge line observations should begin with \'Ln\'" % po)
+                if check_slopes:
+                    tolerances, slope_thrs = po_criteria(pos, tolerance_V, tolerance_Q, slope_thr_V, slope_thr_Q)
+                else:
+                    tolerances, slope_thrs = po_criteria(pos, tolerance_V, tolerance_Q)
+                convergence_time = {po: 'DNC' for po in pos}
+                max_diffs = np.full(len(pos), np.nan)
+                vals_buf = np.empty((0, len(pos)))
+
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            rows = np.array([line.split(',')[1:] for line in lines], dtype=float)
+            # check the new rows against the window kept from the previous polls
+            t = np.concatenate([t_buf, rows[:, 0]])
+            vals = np.concatenate([vals_buf, rows[:, 1:]])
+            conv_idx, last_diffs = window_convergence(t, vals, check_length, tolerances, slope_thrs, check_slopes)
+            if len(t) > check_length:
+                max_diffs = last_diffs
+            for j, po in enumerate(pos):
+                if conv_idx[j] >= 0 and convergence_time[po] == 'DNC':
+                    convergence_time[po] = t[conv_idx[j]]
+                    logging.info('%s converged at t = %.4f' % (po, t[conv_idx[j]]))
+            t_buf = t[-check_length:]
+            vals_buf = vals[-check_length:]
+            logging.info('checked %s up to t = %.4f' % (os.path.basename(po_filename), t[-1]))
+
+            if pos and all(conv != 'DNC' for conv in convergence_time.values()):
+                logging.info('\nall POs converged at t = %.4f - the simulation can be stopped' % max(convergence_time.values()))
+                return convergence_time
+
+        if time.time() - last_growth > stale_timeout:
+            for j, po in enumerate(pos):
+                if convergence_time[po] == 'DNC' and not np.isnan(max_diffs[j]):
+                    convergence_time[po] = f'DNC: {max_diffs[j] * 100:.2f}% max diff'
+            logging.info('\n%s has not grown for %i s, stopping. Convergence times: %s' % (
+                po_filename, stale_timeout, convergence_time))
+            return convergence_time
+        time.sleep(poll_interval)
 
 
 if __name__ == "__main__":
+    if follow_po:
+        follow_po_file(follow_po)
+        sys.exit()
+
+    po_files = []
     for dir, subdirs, files in os.walk(results_folder):
         for PO_file in files:
             if PO_file.endswith('_PO.csv'):
-
-                run_id = PO_file.split('_')[2]
-                run_id_folder = os.path.join(review_folder, run_id)
-                discharge = PO_file.replace('_PO.csv', '')
-                discharge_folder = os.path.join(run_id_folder, discharge)
-
-                # create new folder for run ID and subfolder for discharge, if doesn't exist
-                if not os.path.exists(discharge_folder):
-                    logging.info('Creating discharge folder for {0}'.format(discharge))
-                    os.makedirs(discharge_folder)
-
-                source_path = os.path.join(dir, PO_file)  # path of PO file in results folder
-                po_filename = os.path.join(discharge_folder, PO_file)  # path of PO file in review/runID/discharge folder
-
-                # copy PO file to review/runID/discharge folder
-                shutil.copy(source_path, discharge_folder)
-                logging.info('PO.csv files have been copied from the results folder to discharge folder for {0}'.format(discharge))
-                # run convergence check
-                logging.info('Running convergence check function for {0}'.format(discharge_folder))
-                convergence_check(po_filename)
+                po_files.append(os.path.join(dir, PO_file))  # path of PO file in results folder
+    logging.info('Reviewing {0} PO files with {1} worker(s)...'.format(len(po_files), workers))
+
+    summaries = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(review_po_file, source_path) for source_path in po_files]
+            plot_futures = []
+            for future in as_completed(futures):
+                summary, jobs = future.result()
+                summaries.append(summary)
+                logging.info('Finished {0} ({1}/{2})'.format(summary['discharge'], len(summaries), len(po_files)))
+                # render the plots on the same pool while the remaining checks run
+                plot_futures += [executor.submit(plot_series, **job) for job in jobs]
+            log_summary(summaries)
+            logging.info('Saving {0} PO plots...'.format(len(plot_futures)))
+            for future in plot_futures:
+                future.result()
+    else:
+        plot_jobs = []
+        for source_path in po_files:
+            summary, jobs = review_po_file(source_path)
+            summaries.append(summary)
+            plot_jobs += jobs
+            logging.info('Finished {0} ({1}/{2})'.format(summary['discharge'], len(summaries), len(po_files)))
+        log_summary(summaries)
+        logging.info('Saving {0} PO plots...'.format(len(plot_jobs)))
+        render_plots(plot_jobs)
@@ -3,32 +3,66 @@
 # Created by SJP on 09/02/2020
 
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Set the runID folder containing PO.csv files with incorrect header
 # 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\results\\110'
 result_folder = 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_2_DPDMRY\\results\\133'
-# PO name that is incorrect and needs to be replaced
-mistake = 'STRING TO BE REPLACED'
-# Corrected PO name to use as replacement
-replacement = 'CORRECTED STRING'
-
-for dir, subdirs, files in os.walk(result_folder):
-    for f in files:
-        if f.endswith('PO.csv'):
-            filename = os.path.join(dir, f)
-
-            # read in the file
-            with open(filename, 'r') as opened_file:
-                filedata = opened_file.read()
-
-            # replace the target string
-            if mistake in filedata:
-                filedata = filedata.replace(mistake, replacement)
-                print('Replacing mistake string in %s.' % filename)
-            else:
-                print('WARNING: could not find mistake string \"%s\" in %s.' % (mistake, filename))
-            # write the file with corrected string
-            with open(filename, 'w') as opened_file:
-                opened_file.write(filedata)
+# PO names that are incorrect and need to be replaced, each mapped to the corrected PO name to use as replacement
+replacements = {'STRING TO BE REPLACED': 'CORRECTED STRING'}
+# number of PO files corrected at the same time
+workers = 8
 
 
+# replace incorrect PO names in the header line (line 2) of a PO.csv, leaving the data rows untouched
+# each PO name in the header is matched exactly and mapped once (Pt1 does not also rename Pt10, and a corrected name is
+# not renamed again by another entry); files without any incorrect names are not rewritten, others are written to a
+# temporary file in the same folder that then replaces the original
+# returns the incorrect names that were replaced
+def rename_po_header(filename):
+    with open(filename, 'rb') as opened_file:
+        first_line = opened_file.readline()
+        header = opened_file.readline()
+        data_start = opened_file.tell()
+
+        # split the header into its fields (PO names from the third field), keeping quotes and the line ending
+        header_str = header.decode()
+        line_end = header_str[len(header_str.rstrip('\r\n')):]
+        fields = header_str.rstrip('\r\n').split(',')
+        found = []
+        for i, field in enumerate(fields[2:], 2):
+            name = field.strip().strip('"')
+            if name in replacements:
+                fields[i] = field.replace(name, replacements[name])
+                found.append(name)
+        if not found:
+            print('WARNING: could not find mistake strings %s in %s.' % (list(replacements), filename))
+            return found
+        new_header = (','.join(fields) + line_end).encode()
+        print('Replacing mistake strings %s in %s.' % (found, filename))
+
+        # write the file with corrected header to a temporary file in the same folder, then swap it in
+        fd, temp_filename = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(filename))
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(first_line + new_header)
+            opened_file.seek(data_start)
+            shutil.copyfileobj(opened_file, temp_file, 1024 * 1024)
+
+    shutil.copymode(filename, temp_filename)
+    os.replace(temp_filename, filename)
+    return found
+
+
+if __name__ == "__main__":
+    po_filenames = []
+    for dir, subdirs, files in os.walk(result_folder):
+        for f in files:
+            if f.endswith('PO.csv'):
+                po_filenames.append(os.path.join(dir, f))
+
+    # correct the PO files concurrently (mostly waiting on disk/network I/O)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        renamed = list(executor.map(rename_po_header, po_filenames))
+    print('Corrected %i of %i PO.csv files.' % (sum(1 for found in renamed if found), len(po_filenames)))
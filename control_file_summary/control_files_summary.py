@@ -7,6 +7,8 @@
 
 
 import os
+import json
+import hashlib
 import pandas as pd
 
 import logging
@@ -20,6 +22,8 @@ model_folder = 'FILE PATH'
 runs_folder = 'FILE PATH'
 # example: 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\review'
 review_folder = 'FILE PATH'
+# only re-read the control files that are new or changed since the last summary (False = summarize every control file)
+incremental = True
 
 # Define paths of output files
 tgc_summary = 'tgc_summary_review.csv'
@@ -28,22 +32,132 @@ tbc_summary = 'tbc_summary_review.csv'
 tbc_log_path = os.path.join(review_folder, tbc_summary)
 tcf_summary = 'tcf_summary_review.csv'
 tcf_log_path = os.path.join(review_folder, tcf_summary)
+# summary row, referenced control files, modified times and content hash of each control file summarized
+manifest_path = os.path.join(review_folder, 'control_files_manifest.json')
 
 
-# handles adding entries to each log file
-def add_log(log_path, df):
-    log_type = os.path.basename(log_path)[:3]
-    if not add_log.has_been_called[log_type]:
-        if os.path.exists(log_path):
-            os.remove(log_path)
-        df.to_csv(log_path, index=False, header=True, mode='w')
-    else:
-        df.to_csv(log_path, index=False, header=False, mode='a')
-    add_log.has_been_called[log_type] = True
-add_log.has_been_called = {'tgc': False, 'tbc': False, 'tcf': False}
+# parsed control files: absolute path -> (command tree, modified times of the file and all files it includes)
+_parse_cache = {}
+# files being parsed (to stop Read File loops)
+_parsing = set()
+
+
+# parse a TUFLOW control file (.tcf, .tgc, .tbc, .trd, ...) to a command tree
+# comments (after ! or #) and blank lines are dropped, Read File includes are parsed in place and If Scenario/If Event
+# blocks are kept with all their branches, so the tree can be resolved for any scenario/event (see resolved_commands)
+# each node is a command {'command', 'value', 'line', 'file'} (with the included tree as 'children' for Read File), or
+# an If block {'if': 'Scenario' or 'Event', 'branches': [(names, nodes), ...]} (names = None for the Else branch)
+# parsed files are cached by path and modified time, so files shared by many runs are only parsed once
+def parse_control_file(filename):
+    filename = os.path.abspath(filename)
+    cached = _parse_cache.get(filename)
+    if cached and all(os.path.exists(f) and os.path.getmtime(f) == mtime for f, mtime in cached[1].items()):
+        return cached[0]
+
+    mtimes = {filename: os.path.getmtime(filename)}
+    tree = []
+    # open If blocks, with the list of nodes the next commands are added to
+    blocks = [(None, tree)]
+    _parsing.add(filename)
+    try:
+        with open(filename) as f:
+            for line in f:
+                text = line.split('!')[0].split('#')[0].strip()
+                if not text:
+                    continue
+                command, _, value = [part.strip() for part in text.partition('==')]
+                key = ' '.join(command.lower().split())
+                if key in ['if scenario', 'if event']:
+                    block = {'if': command.split()[-1].capitalize(), 'branches': [([name.strip() for name in value.split('|')], [])]}
+                    blocks[-1][1].append(block)
+                    blocks.append((block, block['branches'][-1][1]))
+                elif key in ['else if scenario', 'else if event', 'else'] and len(blocks) > 1:
+                    block = blocks.pop()[0]
+                    block['branches'].append(([name.strip() for name in value.split('|')] if value else None, []))
+                    blocks.append((block, block['branches'][-1][1]))
+                elif key in ['end if', 'endif'] and len(blocks) > 1:
+                    blocks.pop()
+                else:
+                    node = {'command': command, 'value': value, 'line': line, 'file': filename}
+                    if key == 'read file':
+                        # included files are relative to the folder of the control file reading them
+                        include = os.path.abspath(os.path.join(os.path.dirname(filename), value))
+                        if include in _parsing:
+                            logging.info('WARNING: %s reads itself (through %s), skipping' % (include, filename))
+                            node['children'] = []
+                        elif not os.path.exists(include):
+                            logging.info('WARNING: could not find %s read by %s' % (include, filename))
+                            node['children'] = []
+                        else:
+                            node['children'] = parse_control_file(include)
+                            mtimes.update(_parse_cache[include][1])
+                    blocks[-1][1].append(node)
+    finally:
+        _parsing.discard(filename)
+    _parse_cache[filename] = (tree, mtimes)
+    return tree
+
+
+# yield the commands of a parsed control file in order, with the commands of included files after their Read File
+# If blocks keep the first branch naming one of the given scenarios/events (or the Else branch), or all branches if no
+# scenarios/events are given
+def resolved_commands(tree, scenarios=None, events=None):
+    for node in tree:
+        if 'if' in node:
+            selected = scenarios if node['if'] == 'Scenario' else events
+            if selected is None:
+                branches = [nodes for names, nodes in node['branches']]
+            else:
+                selected = {name.lower() for name in selected}
+                branches = [nodes for names, nodes in node['branches']
+                            if names is None or any(name.lower() in selected for name in names)][:1]
+            for nodes in branches:
+                yield from resolved_commands(nodes, scenarios, events)
+        else:
+            yield node
+            yield from resolved_commands(node.get('children', []), scenarios, events)
+
 
+# lines of the commands of a control file (resolved through its includes and If blocks, from the parse cache)
+def control_lines(control_filename, scenarios=None, events=None):
+    return [node['line'] for node in resolved_commands(parse_control_file(control_filename), scenarios, events)]
 
-# read .tgc and record information to csv
+
+# hash of the contents of a control file and all the files it includes (mtimes from the parse cache)
+def control_file_hash(mtimes):
+    sha = hashlib.sha1()
+    for filename in sorted(mtimes):
+        sha.update(filename.encode())
+        with open(filename, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+# return the manifest entry of a control file, re-reading it only if it (or a file it includes) changed since the
+# manifest entry was made (by modified time, then by content hash)
+# the entry has the summary row, the geometry/BC control files read (for .tcf), the modified times and the hash
+def summarize_control_file(control_filename, entry=None):
+    if entry and all(os.path.exists(f) and os.path.getmtime(f) == mtime for f, mtime in entry['mtimes'].items()):
+        return entry, False
+    parse_control_file(control_filename)
+    mtimes = _parse_cache[control_filename][1]
+    file_hash = control_file_hash(mtimes)
+    if entry and entry['hash'] == file_hash:
+        # touched but not changed
+        return dict(entry, mtimes=mtimes), False
+
+    summary_type = control_filename[-3:]
+    log_df = {'tgc': log_tgc, 'tbc': log_tbc, 'tcf': log_tcf}[summary_type](control_filename)
+    references = []
+    if summary_type == 'tcf':
+        for node in resolved_commands(parse_control_file(control_filename)):
+            if node['command'].lower() in ['geometry control file', 'bc control file']:
+                references.append(os.path.abspath(os.path.join(os.path.dirname(node['file']), node['value'])))
+    row = log_df.iloc[0].to_dict()
+    return {'summary': summary_type, 'row': row, 'references': references, 'mtimes': mtimes, 'hash': file_hash}, True
+
+
+# read .tgc and return its information as a one row table
 def log_tgc(tgc_filename, *args, **kwargs):
     get_strs = {'READ GIS LOCATION': lambda line, get_str: line.split(get_str)[1].replace('\n', ''),
                 'Read GRID Zpts': lambda line, get_str: line.split(get_str)[1].replace('\n', ''),
@@ -51,14 +165,12 @@ def log_tgc(tgc_filename, *args, **kwargs):
                 'Read GIS Mat': lambda line, get_str: line.split(get_str)[1].replace('\n', '')
                 }
     out_dict = {get_str: '' for get_str in get_strs.keys()}
-    with open(tgc_filename) as f:
-        lines = f.readlines()
-        for line in lines:
-            for get_str in get_strs.keys():
-                if get_str in line:
-                    data = get_strs[get_str](line, get_str + ' ==')
-                    out_dict[get_str] = [data]
-                    logging.info(f'Got {get_str} = {data}')
+    for line in control_lines(tgc_filename):
+        for get_str in get_strs.keys():
+            if get_str in line:
+                data = get_strs[get_str](line, get_str + ' ==')
+                out_dict[get_str] = [data]
+                logging.info(f'Got {get_str} = {data}')
 
     log_df = pd.DataFrame.from_dict(out_dict)
     log_df = log_df.reindex(['READ GIS LOCATION', 'Read GRID Zpts', 'Read GIS Code', 'Read GIS Mat'], axis='columns')
@@ -67,24 +179,21 @@ def log_tgc(tgc_filename, *args, **kwargs):
     run_id = tgc_filename.split('_')[-2]
     log_df.insert(loc=0, column='Run ID', value=[run_id])
 
-    add_log(tgc_log_path, log_df)
-    logging.info('\nsaved tgc GIS files table: %s\n' % tgc_log_path)
+    return log_df
 
 
-# read .tbc and record information to csv
+# read .tbc and return its information as a one row table
 def log_tbc(tbc_filename, *args, **kwargs):
     get_strs = {'Read GIS BC': lambda line, get_str: line.split(get_str)[1].replace('\n', ''),
                 'Read GIS SA': lambda line, get_str: line.split(get_str)[1].replace('\n', '')
                 }
     out_dict = {get_str: '' for get_str in get_strs.keys()}
-    with open(tbc_filename) as f:
-        lines = f.readlines()
-        for line in lines:
-            for get_str in get_strs.keys():
-                if get_str in line:
-                        data = get_strs[get_str](line, get_str + ' ==')
-                        out_dict[get_str] = [data]
-                        logging.info(f'Got {get_str} = {data}')
+    for line in control_lines(tbc_filename):
+        for get_str in get_strs.keys():
+            if get_str in line:
+                    data = get_strs[get_str](line, get_str + ' ==')
+                    out_dict[get_str] = [data]
+                    logging.info(f'Got {get_str} = {data}')
 
     log_df = pd.DataFrame.from_dict(out_dict)
     log_df = log_df.reindex(['Read GIS BC', 'Read GIS SA'], axis='columns')
@@ -93,11 +202,10 @@ def log_tbc(tbc_filename, *args, **kwargs):
     run_id = tbc_filename.split('_')[-2]
     log_df.insert(loc=0, column='Run ID', value=[run_id])
 
-    add_log(tbc_log_path, log_df)
-    logging.info('\nsaved tbc GIS files table: %s\n' % tbc_log_path)
+    return log_df
 
 
-# read .tcf and record information to csv
+# read .tcf and return its information as a one row table
 def log_tcf(tcf_filename, *args, **kwargs):
     get_strs = {'Read GIS PO': lambda line, get_str: line.split(get_str)[1].split(' !')[0],
                 'Viscosity Formulation': lambda line, get_str: line.split(get_str)[1].replace('\n', ''),
@@ -105,18 +213,16 @@ def log_tcf(tcf_filename, *args, **kwargs):
                 'Cell Wet/Dry Depth': lambda line, get_str: line.split(get_str)[1].split(' !')[0]
                 }
     out_dict = {get_str: '' for get_str in get_strs.keys()}
-    with open(tcf_filename) as f:
-        lines = f.readlines()
-        for line in lines:
-            for get_str in get_strs.keys():
-                if get_str in line:
-                        data = get_strs[get_str](line, get_str + ' ==')
-                        if out_dict[get_str] != '':
-                            # if get_str occurs twice (Read GIS PO), make second column
-                            out_dict[get_str + '_2'] = [data]
-                        else:
-                            out_dict[get_str] = [data]
-                        logging.info(f'Got {get_str} = {data}')
+    for line in control_lines(tcf_filename):
+        for get_str in get_strs.keys():
+            if get_str in line:
+                    data = get_strs[get_str](line, get_str + ' ==')
+                    if out_dict[get_str] != '':
+                        # if get_str occurs twice (Read GIS PO), make second column
+                        out_dict[get_str + '_2'] = [data]
+                    else:
+                        out_dict[get_str] = [data]
+                    logging.info(f'Got {get_str} = {data}')
 
     log_df = pd.DataFrame.from_dict(out_dict)
     log_df = log_df.reindex(['Read GIS PO', 'Read GIS PO_2', 'Viscosity Formulation', 'Viscosity Coefficients', 'Cell Wet/Dry Depth'], axis='columns')
@@ -125,27 +231,51 @@ def log_tcf(tcf_filename, *args, **kwargs):
     run_id = tcf_filename.split('_')[-2]
     log_df.insert(loc=0, column='Run ID', value=[run_id])
 
-    add_log(tcf_log_path, log_df)
-    logging.info('\nsaved tcf GIS files table: %s\n' % tcf_log_path)
+    return log_df
 
 
 if __name__ == "__main__":
+    control_filenames = []
     for dir, subdirs, files in os.walk(model_folder):
         for control_file in files:
-            control_filename = os.path.join(dir, control_file)  # path of control file in the model or run folder
-            # for .tgc file
-            if control_file.endswith('.tgc'):
-                logging.info('Collecting GIS file information from TGC file...')
-                log_tgc(tgc_filename=control_filename)
-            # for .tbc file
-            if control_file.endswith('.tbc'):
-                logging.info('Collecting GIS file information from TBC file...')
-                log_tbc(tbc_filename=control_filename)
-
+            if control_file.endswith('.tgc') or control_file.endswith('.tbc'):
+                control_filenames.append(os.path.abspath(os.path.join(dir, control_file)))  # path of control file in the model folder
+    tcf_filenames = []
     for dir, subdirs, files in os.walk(runs_folder):
         for control_file in files:
-            control_filename = os.path.join(dir, control_file)  # path of control file in the model or run folder
-            # for .tcf file
             if control_file.endswith('.tcf'):
-                logging.info('Collecting information from TCF file...')
-                log_tcf(tcf_filename=control_filename)
+                tcf_filenames.append(os.path.abspath(os.path.join(dir, control_file)))  # path of control file in the run folder
+
+    manifest = {}
+    if incremental and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # summarize the .tcf files first to add the geometry and BC control files they read that are not in the model folder
+    new_manifest = {}
+    n_changed = 0
+    for control_filename in tcf_filenames:
+        logging.info('Collecting information from TCF file...')
+        new_manifest[control_filename], changed = summarize_control_file(control_filename, manifest.get(control_filename))
+        n_changed += changed
+        for referenced in new_manifest[control_filename]['references']:
+            if referenced not in control_filenames and os.path.exists(referenced):
+                control_filenames.append(referenced)
+    for control_filename in control_filenames:
+        logging.info('Collecting GIS file information from %s file...' % control_filename[-3:].upper())
+        new_manifest[control_filename], changed = summarize_control_file(control_filename, manifest.get(control_filename))
+        n_changed += changed
+    logging.info('Read %i new or changed control files (%i unchanged)' % (n_changed, len(new_manifest) - n_changed))
+
+    # write each summary table from the rows in the manifest (tgc and tbc in model folder order, then tcf)
+    for summary_type, log_path in [('tgc', tgc_log_path), ('tbc', tbc_log_path), ('tcf', tcf_log_path)]:
+        rows = [new_manifest[f]['row'] for f in control_filenames + tcf_filenames if new_manifest[f]['summary'] == summary_type]
+        if rows:
+            pd.DataFrame(rows).to_csv(log_path, index=False)
+            logging.info('\nsaved %s GIS files table: %s\n' % (summary_type, log_path))
+        elif os.path.exists(log_path):
+            os.remove(log_path)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(new_manifest, f, indent=1)
+    logging.info('saved control files manifest: %s' % manifest_path)
@@ -1,16 +1,26 @@
 # Python script for creating a CSV with summary information from the .tlf and .hpc.tlf TUFLOW log files that can be copied and pasted into the modeling log worksheet
 # Last updated on 01/20/2021 by SJP
 
-# Step 1 - copy this script for use into your review folder
-# Step 2 - set the ..\\log\\runID folder, the ..\\review\\runID folder, and the modeler's initials
+# Step 1 - copy this script (and review_utils.py from the top-level scripts folder) for use into your review folder
+# Step 2 - set the ..\\log\\runID folder (or the whole ..\\log folder), the ..\\review folder, and the modeler's initials
 # Step 3 - check the CSV file created in the review folder and copy to the modeling log worksheet
+#          (log_review_summary.csv in the review folder has one row for every discharge reviewed)
 
 import os
+import re
+import mmap
+import sys
 import pandas as pd
 import numpy as np
 import datetime as dt
+import itertools
 import shutil
-import matplotlib.pyplot as plt
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# shared rolling window statistics and plotting (review_utils.py in this folder or the top-level scripts folder)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from review_utils import rolling_slopes, sliding_extreme, plot_series, plot_job, render_plots
 
 import logging
 FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
@@ -18,14 +28,43 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 
 # VARIABLES - MAKE CHANGES HERE (set folders and modeler)
 # example: 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\runs\\Log\\125'
+# (or 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\runs\\Log' to review every runID)
 log_folder = 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_2_DPDMRY\\runs\\Log\\182'
 # example: 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\review\\125'
 review_folder = 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_2_DPDMRY\\review'
 # person who ran model
 modeler = 'SJP'
+# number of log files reviewed in parallel (1 = one after another)
+workers = 4
+# save .png plots of nWet and volume (False for a numbers-only review)
+make_plots = True
+# save the HPC timestep profile (per simulation hour table and timestep histogram) from the hpc.tlf
+profile_timesteps = True
+
+# FOLLOW MODE - set to the .hpc.tlf of a running simulation to check nWet/volume convergence as TUFLOW writes it
+# (instead of reviewing the log folder); alarms are written to a _ALARM.txt flag file and end the script with exit code 1
+# example: 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_2_DPDMRY\\runs\\Log\\182\\....hpc.tlf'
+follow_hpc = None
+# seconds between checks of the followed hpc.tlf
+poll_interval = 60
+# stop following if the hpc.tlf has not grown for this many seconds (simulation finished or stopped)
+stale_timeout = 3600
+# alarm when the number of lines reporting NaNs is more than this
+nan_alarm = 0
+# alarm when the number of repeated timesteps is more than this
+repeat_alarm = 100
+# alarm when the volume grows to more than this many times the volume check_length timesteps earlier
+vol_growth_alarm = 2
+# only check the volume growth after this simulation time (hours), to skip the initial filling of the model
+vol_alarm_after = 1
 
 # DO NOT CHANGE ANYTHING BELOW (unless you know what you are doing)
 
+# number of values to check back for trending
+check_length = 500
+# slope threshold for linear regression line
+slope_thr_nwet = 0.01
+
 # return volumes as strings (convert ' to 000)
 def vol_str(num):
     num_str = '%i' % num
@@ -39,6 +78,49 @@ def vol_str(num):
 def raw_vol(num):
     return int(vol_str(num).replace("\'", ''))
 
+# return an array of volumes as integers (raw_vol of every value, quantized in one pass over the array)
+def raw_vols(nums):
+    nums = np.asarray(nums)
+    raw = np.trunc(nums).astype(np.int64)
+    mag = 0
+    # volumes that still need more than 6 characters are divided by another 1000
+    todo = (raw > 999999) | (raw < -99999)
+    while todo.any():
+        mag += 1
+        raw[todo] = np.trunc(nums[todo] / (1000 ** mag)).astype(np.int64)
+        todo &= (raw > 999999) | (raw < -99999)
+    return raw
+
+# memory-map a log file read-only (the OS pages in only the parts that are searched, nothing is copied into Python)
+def map_log(filename):
+    with open(filename, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# return the line of a memory-mapped log that contains position pos (decoded, with a \n line ending)
+def mapped_line(mm, pos):
+    start = mm.rfind(b'\n', 0, pos) + 1
+    end = mm.find(b'\n', pos)
+    end = len(mm) if end < 0 else end + 1
+    return mm[start:end].decode(errors='replace').replace('\r\n', '\n'), end
+
+# yield the lines of a memory-mapped log between positions start and stop that contain a match of the compiled
+# (bytes) pattern, in order - the map is searched in one pass, only the matching lines are decoded
+def matching_lines(mm, pattern, start=0, stop=None):
+    stop = len(mm) if stop is None else stop
+    match = pattern.search(mm, start, stop)
+    while match:
+        line, end = mapped_line(mm, match.start())
+        yield line
+        match = pattern.search(mm, end, stop)
+
+# position of the end of the last line of a memory-mapped log that contains any of the strings, searching backwards
+# from the end of the log (None if any of the strings is not in the log)
+def end_of_last(mm, strs):
+    positions = [mm.rfind(s.encode()) for s in strs]
+    if min(positions) < 0:
+        return None
+    return mapped_line(mm, max(positions))[1]
+
 # read .tlf and record information to csv
 def log_info(tlf_filename, *args, **kwargs):
     get_strs = {'BC Database == ': lambda line, get_str: line.split('\\')[-1].replace('\n', ''),
@@ -63,12 +145,18 @@ def log_info(tlf_filename, *args, **kwargs):
                 'Final Cumulative ME:': lambda line, get_str: line.split(get_str)[1].replace(' ', '').replace('\n', '')
                 }
     mat_file_get_strs = ['Read GRID CnM ==', 'Fixed Manning\'s n = ']
+    # end of simulation summary lines, found by searching back from the end of the log (the log is read up to the last
+    # of these)
+    summary_strs = {'WARNINGs prior to simulation: ', 'WARNINGs during simulation: ', 'CHECKs prior to simulation: ',
+                    'CHECKs during simulation: ', 'Volume Error (ft3):     ', 'Final Cumulative ME:', 'CPU Time: ',
+                    'Clock Time: '}
+    # all strings compiled into one pattern, so only the lines containing any of them are checked below
+    get_strs_pattern = re.compile(b'|'.join(re.escape(get_str.strip().encode()) for get_str in list(get_strs) + mat_file_get_strs))
     mat_type = None
     mat_file = []
     out_dict = {get_str.split(':')[0]: '' for get_str in get_strs.keys()}
-    with open(tlf_filename) as f:
-        lines = f.readlines()
-        for line in lines:
+    with map_log(tlf_filename) as mm:
+        for line in matching_lines(mm, get_strs_pattern, stop=end_of_last(mm, summary_strs)):
             for get_str in get_strs.keys():
                 if get_str in line:
                         data = get_strs[get_str](line, get_str)
@@ -91,87 +179,195 @@ def log_info(tlf_filename, *args, **kwargs):
     log_path = tlf_filename.replace('.tlf', '_log_review.csv')
     log_df.to_csv(log_path, index=False)
     logging.info('\nsaved log review table: %s\n' % log_path)
-
+    return log_df
+
+
+# convert a chunk of split iStep table rows (time split into h, m, s fields) to typed columns
+# time is converted to hours and vol from ' notation (thousands) to cu.ft.
+def hpc_columns(header, fields):
+    columns = {}
+    k = 0
+    for col in header:
+        if col == 'time':
+            columns[col] = fields[:, k].astype(np.int64) + fields[:, k + 1].astype(float) / 60 + fields[:, k + 2].astype(float) / 3600
+            k += 3
+            continue
+        if col == 'vol':
+            columns[col] = np.char.strip(fields[:, k], "\'").astype(np.int64) * 1000 ** np.char.count(fields[:, k], "\'").astype(np.int64)
+        elif col in ['iStep', 'nWet']:
+            columns[col] = fields[:, k].astype(np.int64)
+        else:
+            columns[col] = fields[:, k].astype(float)
+        k += 1
+    return columns
+
+# split the iStep table rows out of a list of hpc.tlf lines (with n_fields fields once time is split into h, m, s)
+# repeated iStep headers, 'Memory released' and 'Repeating step' lines are left out
+# if a repeat_rows list is given, the table row index that follows each 'Repeating step' line is appended to it
+# (n_rows = number of table rows before these lines)
+def hpc_table_rows(lines, n_fields, repeat_rows=None, n_rows=0):
+    rows = []
+    for line in lines:
+        if line.startswith('Repeating step'):
+            # position of the repeated step in the table (number of table rows kept before it)
+            if repeat_rows is not None:
+                repeat_rows.append(n_rows + len(rows))
+        elif not ('iStep' in line or 'Memory released' in line):
+            row = line.replace(':', ' ').split()
+            if len(row) == n_fields:
+                rows.append(row)
+    return rows
+
+# read the iStep table of a .hpc.tlf in one streaming pass, chunk_lines lines at a time
+# repeated iStep headers, 'Memory released' and 'Repeating step' lines (and any other lines that are not table rows)
+# are filtered out as the file is read, so only the typed columns are held in memory
+# if a repeat_rows list is given, the table row index that follows each 'Repeating step' line is appended to it
+# returns a dict of column name: numpy array (see hpc_columns), in the order of the iStep header
+def read_hpc_tlf(hpctlf_filename, chunk_lines=100000, repeat_rows=None):
+    chunks = []
+    n_rows = 0
+    # jump to the first iStep header
+    with map_log(hpctlf_filename) as mm:
+        header_pos = mm.find(b'iStep')
+        table_start = mm.rfind(b'\n', 0, header_pos) + 1
+    if header_pos < 0:
+        raise ValueError(f'No iStep table found in {hpctlf_filename}')
+    with open(hpctlf_filename) as f:
+        f.seek(table_start)
+        header = f.readline().split()
+        n_fields = len(header) + 2
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines:
+                break
+            rows = hpc_table_rows(lines, n_fields, repeat_rows, n_rows)
+            n_rows += len(rows)
+            if rows:
+                chunks.append(hpc_columns(header, np.array(rows)))
+    if not chunks:
+        chunks.append(hpc_columns(header, np.empty((0, n_fields), dtype=str)))
+    return {col: np.concatenate([chunk[col] for chunk in chunks]) for col in header}
+
+# profile the HPC solver timestep from the hpc.tlf columns (dt, maxNu, maxNc, maxNd) and the 'Repeating step' lines
+# (repeat_rows from read_hpc_tlf), to show when in the simulation and why the model ran slowly
+# saves a table per simulation hour (_hpc_profile.csv) and a timestep histogram (_dt_histogram.csv)
+def timestep_profile(hpctlf_filename, hpc_cols, repeat_rows, make_plots=True, plot_jobs=None):
+    # timesteps smaller than this fraction of the largest timestep are counted as reduced
+    reduced_dt_ratio = 0.5
+    # number of bins for the timestep histogram
+    dt_bins = 20
+    # control number limits the HPC timestep is adapted to (Courant Nu, celerity Nc, diffusion Nd)
+    limits = {'maxNu': 1.0, 'maxNc': 1.0, 'maxNd': 0.3}
+
+    if 'dt' not in hpc_cols or not len(hpc_cols['dt']):
+        logging.info('no timesteps to profile in %s' % hpctlf_filename)
+        return
+    step_time = hpc_cols['time']
+    step_dt = hpc_cols['dt']
+    step_df = pd.DataFrame({'hour': np.floor(step_time).astype(np.int64), 'dt': step_dt})
+    step_df['reduced'] = step_dt < reduced_dt_ratio * step_dt.max()
+    # control number closest to its limit at each timestep (the one limiting the timestep)
+    driver_cols = [col for col in limits if col in hpc_cols]
+    if driver_cols:
+        ratios = np.column_stack([hpc_cols[col] / limits[col] for col in driver_cols])
+        step_df['driver'] = np.array([col.replace('max', '') for col in driver_cols])[ratios.argmax(axis=1)]
+
+    # table per simulation hour
+    hours = step_df.groupby('hour')
+    profile_df = pd.DataFrame({'steps': hours.dt.count(), 'mean dt (s)': hours.dt.mean(), 'min dt (s)': hours.dt.min(),
+                               'reduced dt steps': hours.reduced.sum()})
+    repeat_hours = step_df.hour.to_numpy()[np.minimum(repeat_rows, len(step_dt) - 1)] if repeat_rows else []
+    profile_df['repeated steps'] = pd.Series(repeat_hours, dtype=np.int64).value_counts().reindex(profile_df.index, fill_value=0)
+    if driver_cols:
+        drivers = pd.crosstab(step_df.hour, step_df.driver).reindex(columns=[col.replace('max', '') for col in driver_cols], fill_value=0)
+        for driver in drivers.columns:
+            profile_df[f'{driver} limited steps'] = drivers[driver]
+    profile_df.index.name = 'hour'
+    profile_path = hpctlf_filename.replace('.hpc.tlf', '_hpc_profile.csv')
+    profile_df.to_csv(profile_path)
+    logging.info('\nsaved timestep profile table: %s\n' % profile_path)
+
+    # timestep histogram (number of steps and simulated hours in each dt range)
+    counts, edges = np.histogram(step_dt, bins=dt_bins)
+    hours_in_bin, _ = np.histogram(step_dt, bins=edges, weights=step_dt / 3600)
+    hist_df = pd.DataFrame({'dt from (s)': edges[:-1], 'dt to (s)': edges[1:], 'steps': counts, 'simulated hours': hours_in_bin})
+    hist_path = hpctlf_filename.replace('.hpc.tlf', '_dt_histogram.csv')
+    hist_df.to_csv(hist_path, index=False)
+    logging.info('saved timestep histogram: %s\n' % hist_path)
+
+    reduced = step_df.reduced.to_numpy()
+    logging.info('timestep (s): min = %.4f, median = %.4f, max = %.4f' % (step_dt.min(), np.median(step_dt), step_dt.max()))
+    logging.info('reduced timestep (< %.2f x max): %i of %i steps (%.1f%%), %.2f simulated hours' % (
+        reduced_dt_ratio, reduced.sum(), len(step_dt), 100 * reduced.mean(), step_dt[reduced].sum() / 3600))
+    logging.info('repeated steps: %i' % len(repeat_rows))
+    if driver_cols:
+        logging.info('timestep limited by: ' + ', '.join(
+            '%s %.1f%%' % (driver, 100 * (step_df.driver == driver).mean()) for driver in drivers.columns))
+
+    # plot timestep and save to .png
+    if make_plots:
+        jobs = [plot_job(hpctlf_filename.replace('.hpc.tlf', '_dt.png'), step_time, step_dt, 'dt', 'Time (hrs)', 'Timestep (s)',
+                         bbox_inches='tight')]
+        if plot_jobs is None:
+            render_plots(jobs)
+        else:
+            plot_jobs.extend(jobs)
+
+# index of the first timestep where the slope of the linear regression line of nWet over the previous check_length
+# values is within slope_thr (-1 if nWet does not converge)
+def nwet_convergence(t, nwet, check_length, slope_thr):
+    slopes = rolling_slopes(t, nwet, check_length)[:len(t) - check_length]
+    within_thr = np.flatnonzero(np.abs(slopes) <= slope_thr)
+    return within_thr[0] + check_length if within_thr.size else -1
+
+# index of the first timestep where the volume is equal to each of the previous check_length volumes, within 1 rounded
+# unit (-1 if the volume does not converge)
+def vol_convergence(vols, check_length):
+    n_checks = len(vols) - check_length
+    if n_checks <= 0:
+        return -1
+    # the largest difference is always to the min or max of the previous check_length rounded values
+    raw = raw_vols(vols)
+    current = raw[check_length:]
+    win_max = sliding_extreme(raw[:, np.newaxis], check_length, np.maximum)[:n_checks, 0]
+    win_min = sliding_extreme(raw[:, np.newaxis], check_length, np.minimum)[:n_checks, 0]
+    constant = np.flatnonzero(np.maximum(current - win_min, win_max - current) <= 1)
+    return constant[0] + check_length if constant.size else -1
 
 # read hpc.tlf and .tlf to a dataframe
-def trending_check(hpctlf_filename, *args, **kwargs):
-    # number of values to check back for trending
-    check_length = 500
-    # slope threshold for linear regression line
-    slope_thr_nwet = 0.01
-
-    # get start row
-    start_row = 0
-    skip_rows = []
-    with open(hpctlf_filename) as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-            if 'iStep' in line:
-                if start_row == 0:
-                    start_row = i
-                else:
-                    skip_rows.append(i)
-            if start_row != 0:
-                if 'Memory released' in line:
-                    skip_rows.append(i)
-                if line.startswith('Repeating step'):
-                    skip_rows.append(i)
-
-    vol_convert = lambda x: int(x.replace("\'", '000'))
-
-    def time_convert(x):
-        h, m, s = x.split(':')
-        return int(h) + float(m)/60 + float(s)/3600
-
-    # parse hpc.tlf csv to dataframe
-    df = pd.read_csv(hpctlf_filename, header=start_row, skiprows=skip_rows, delim_whitespace=True,
-                     converters={'vol': vol_convert, 'time': time_convert})
-    df.drop(['iStep', 'maxNu', 'maxNc', 'maxNd', 'dt'], axis=1, inplace=True)
+# plots are rendered at the end of the check, or appended to plot_jobs (if given) to be rendered later with render_plots
+# the timestep profile (see timestep_profile) is made from the same read of the hpc.tlf if profile is True
+def trending_check(hpctlf_filename, make_plots=True, plot_jobs=None, profile=True, *args, **kwargs):
+    # parse hpc.tlf iStep table to dataframe (without the solver columns, which are only used by the timestep profile)
+    repeat_rows = []
+    hpc_cols = read_hpc_tlf(hpctlf_filename, repeat_rows=repeat_rows)
+    if profile:
+        timestep_profile(hpctlf_filename, hpc_cols, repeat_rows, make_plots=make_plots, plot_jobs=plot_jobs)
+    df = pd.DataFrame({col: vals for col, vals in hpc_cols.items() if col not in ['iStep', 'maxNu', 'maxNc', 'maxNd', 'dt']})
     cols = df.columns[1:]
 
     # initialize convergence times dict ('DNC' = does not converge)
     convergence_time = {col: ['DNC'] for col in cols}
 
-    # iterate over columns and plot/save to .png
-    for col in cols:
-        plt.clf()
-        x = df.time
-        plt.xlabel('Time (hrs)', fontsize=12)
-        y = df[col]
-        plt.plot(x, y)
-        plt.title(col)
-
-        if col.startswith('nWet'):
-            plt.ylabel('Number of Wetted Cells', fontsize=12)
-        else:
-            plt.ylabel('Volume (cu.ft.)', fontsize=12)
-
-        plt.savefig(hpctlf_filename.replace('.hpc.tlf', '_' + col + '.png'), bbox_inches='tight')
-
     # iterate over nWet and volume columns
     for col in cols:
         logging.info('checking %s...' % col)
         if col.startswith('nWet'):
-            slope_thr = slope_thr_nwet
-            # iterate through nWet values
-            for i in range(check_length, len(df.time)):
-                # check slope of linear regression line
-                t = df.time[i - check_length: i]
-                vals = df[col][i - check_length: i]
-                slope, yint = np.polyfit(t, vals, deg=1)
-                # check if slope of linear regression is within slope threshold
-                if abs(slope) <= slope_thr:
-                    convergence_time[col] = [df.time[i]]
-                    break
+            # first timestep where slope of linear regression is within slope threshold
+            i = nwet_convergence(df.time, df[col], check_length, slope_thr_nwet)
+            if i >= 0:
+                convergence_time[col] = [df.time[i]]
         if col.startswith('vol'):
-            for i in range(check_length, len(df.time)):
-                # check if current value is equal to previous value
-                previous_vals = df[col][i - check_length: i]
-                current_val = df[col][i]
-                if np.all([abs(raw_vol(current_val) - raw_vol(val)) <= 1 for val in previous_vals]):
+            vols = df[col].to_numpy()
+            if len(vols) > check_length:
+                # first timestep where current value is equal to previous values
+                i = vol_convergence(vols, check_length)
+                if i >= 0:
                     convergence_time[col] = [df.time[i]]
-                    break
-            logging.info(f'range of last {check_length} volume values: [{vol_str(min(previous_vals))}, {vol_str(max(previous_vals))}]')
+                else:
+                    i = len(vols) - 1
+                previous_vals = vols[i - check_length: i]
+                logging.info(f'range of last {check_length} volume values: [{vol_str(min(previous_vals))}, {vol_str(max(previous_vals))}]')
 
     # get final volume (numeric)
     final_vol = df.vol.iloc[-1]
@@ -203,34 +399,208 @@ def trending_check(hpctlf_filename, *args, **kwargs):
                 '\nvolume convergence = previous %i values stay constant' % (
         check_length))
 
+    # plot each column and save to .png
+    if make_plots:
+        jobs = [plot_job(hpctlf_filename.replace('.hpc.tlf', '_' + col + '.png'), df.time.to_numpy(), df[col].to_numpy(),
+                         col, 'Time (hrs)', 'Number of Wetted Cells' if col.startswith('nWet') else 'Volume (cu.ft.)',
+                         bbox_inches='tight')
+                for col in cols]
+        if plot_jobs is None:
+            render_plots(jobs)
+        else:
+            plot_jobs.extend(jobs)
+    return conv_df
+
+# copy log file to review/runID/discharge folder and run the trending check (.hpc.tlf) or log info (.tlf), logging to
+# a file in that folder
+# returns a summary row for the discharge and its deferred plots
+def review_log_file(source_path):
+    log_file = os.path.basename(source_path)
+    run_id = log_file.split('_')[2]
+    run_id_folder = os.path.join(review_folder, run_id)
+    is_hpc = log_file.endswith('.hpc.tlf')
+    discharge = log_file.replace('.hpc.tlf', '').replace('.tlf', '')
+    discharge_folder = os.path.join(run_id_folder, discharge)
+    status_col = 'hpc.tlf status' if is_hpc else 'tlf status'
+    summary = {'run ID': run_id, 'discharge': discharge, status_col: 'OK'}
+    plot_jobs = []
+
+    # create new folder for run ID and subfolder for discharge, if doesn't exist
+    os.makedirs(discharge_folder, exist_ok=True)
+    log_filename = os.path.join(discharge_folder, log_file)  # log filename
+
+    # send this log file's messages to its own file so parallel reviews don't interleave
+    log_handler = logging.FileHandler(os.path.join(discharge_folder, discharge + ('_hpc' if is_hpc else '') + '_review.log'), mode='w')
+    log_handler.setFormatter(logging.Formatter(FORMAT))
+    root_logger = logging.getLogger()
+    console_handlers = root_logger.handlers[:]
+    root_logger.handlers = [log_handler]
+    try:
+        # copy log file to review/runID/discharge folder
+        shutil.copy(source_path, discharge_folder)
+        logging.info(
+            'log files have been copied from the results folder to discharge folder for {0}'.format(discharge))
+        # for hpc.tlf file
+        if is_hpc:
+            # run trending check and determine final discharge
+            logging.info('Running convergence check function for {0}'.format(discharge_folder))
+            conv_df = trending_check(hpctlf_filename=log_filename, make_plots=make_plots, plot_jobs=plot_jobs,
+                                     profile=profile_timesteps)
+        # for regular .tlf file
+        else:
+            logging.info('Running log info function for {0}'.format(discharge_folder))
+            conv_df = log_info(tlf_filename=log_filename)
+        summary.update(conv_df.iloc[0].to_dict())
+    except Exception as e:
+        logging.exception('Log review failed for {0}'.format(log_file))
+        summary[status_col] = 'FAILED: {0}'.format(e)
+    finally:
+        root_logger.handlers = console_handlers
+        log_handler.close()
+    return summary, plot_jobs
+
+# save one table for all reviewed discharges to the review folder (log info and hpc summary of a discharge in one row)
+def save_summary(summaries):
+    rows = {}
+    # log info columns first, then the hpc summary columns
+    for summary in sorted(summaries, key=lambda summary: 'hpc.tlf status' in summary):
+        rows.setdefault((summary['run ID'], summary['discharge']), {}).update(summary)
+    if rows:
+        summary_df = pd.DataFrame(list(rows.values())).sort_values(['run ID', 'discharge'], ignore_index=True)
+        # status of each review in the last columns
+        status_cols = [col for col in ['tlf status', 'hpc.tlf status'] if col in summary_df.columns]
+        summary_df = summary_df[[col for col in summary_df.columns if col not in status_cols] + status_cols]
+        summary_path = os.path.join(review_folder, 'log_review_summary.csv')
+        summary_df.to_csv(summary_path, index=False)
+        logging.info('\nsaved log review summary table (%i discharges): %s\n' % (len(summary_df), summary_path))
+
+# watch the .hpc.tlf of a running simulation and check nWet/volume convergence on the timesteps appended since the
+# last poll (only the last check_length timesteps are kept between polls), logging each as it converges
+# NaNs, repeated timesteps and volume growth are checked against the alarm thresholds, and the alarms are written to a
+# _ALARM.txt flag file next to the hpc.tlf so the simulation can be stopped
+# returns the convergence times and the list of alarms, once both have converged, an alarm is raised, or the file
+# stops growing for stale_timeout seconds
+def follow_hpc_file(hpctlf_filename):
+    offset = 0
+    pending = b''
+    header = None
+    n_rows = 0
+    repeat_rows = []
+    nan_lines = 0
+    t_buf = np.empty(0)
+    nwet_buf = np.empty(0)
+    vol_buf = np.empty(0)
+    convergence_time = {'nWet': 'DNC', 'vol': 'DNC'}
+    alarms = []
+    last_growth = time.time()
+
+    while True:
+        # the file may not be created yet if the simulation was started with the watcher
+        try:
+            with open(hpctlf_filename, 'rb') as f:
+                f.seek(offset)
+                new_data = f.read()
+        except FileNotFoundError:
+            new_data = b''
+        offset += len(new_data)
+        if new_data:
+            last_growth = time.time()
+        # only parse complete lines, keep any partly written line for the next poll
+        pending += new_data
+        complete, _, pending = pending.rpartition(b'\n')
+        lines = complete.decode().splitlines() if complete else []
+
+        # skip to the first iStep header
+        while lines and header is None:
+            line = lines.pop(0)
+            if 'iStep' in line:
+                header = line.split()
+        # lines reporting NaNs are counted and left out of the table
+        nan_lines += sum('NaN' in line for line in lines)
+        lines = [line for line in lines if 'NaN' not in line]
+        rows = hpc_table_rows(lines, len(header) + 2, repeat_rows, n_rows) if header else []
+        n_rows += len(rows)
+
+        if rows:
+            hpc_cols = hpc_columns(header, np.array(rows))
+            # check the new timesteps against the window kept from the previous polls
+            t = np.concatenate([t_buf, hpc_cols['time']])
+            nwet = np.concatenate([nwet_buf, hpc_cols['nWet']])
+            vols = np.concatenate([vol_buf, hpc_cols['vol']])
+            for col, i in (('nWet', nwet_convergence(t, nwet, check_length, slope_thr_nwet)),
+                           ('vol', vol_convergence(vols, check_length))):
+                if i >= 0 and convergence_time[col] == 'DNC':
+                    convergence_time[col] = t[i]
+                    logging.info('%s converged at t = %.4f' % (col, t[i]))
+            # volume growth over check_length timesteps (after the initial filling)
+            if len(vols) > check_length:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    growth = vols[check_length:] / vols[:-check_length]
+                growth[(t[check_length:] < vol_alarm_after) | (vols[:-check_length] <= 0)] = np.nan
+                if np.any(growth > vol_growth_alarm):
+                    i = np.flatnonzero(growth > vol_growth_alarm)[0] + check_length
+                    alarms.append('volume grew to %s (%.1f x the volume %i timesteps earlier) at t = %.4f' % (
+                        vol_str(vols[i]), growth[i - check_length], check_length, t[i]))
+            t_buf = t[-check_length:]
+            nwet_buf = nwet[-check_length:]
+            vol_buf = vols[-check_length:]
+            logging.info('checked %s up to t = %.4f (final vol = %s)' % (os.path.basename(hpctlf_filename), t[-1], vol_str(vols[-1])))
+
+        if nan_lines > nan_alarm:
+            alarms.append('%i lines with NaNs' % nan_lines)
+        if len(repeat_rows) > repeat_alarm:
+            alarms.append('%i repeated timesteps' % len(repeat_rows))
+        if alarms:
+            alarm_path = hpctlf_filename.replace('.hpc.tlf', '_ALARM.txt')
+            with open(alarm_path, 'w') as f:
+                f.write('\n'.join(alarms) + '\n')
+            logging.info('\nALARM for %s: %s\nsaved alarm flag file: %s' % (hpctlf_filename, '; '.join(alarms), alarm_path))
+            return convergence_time, alarms
+
+        if all(conv != 'DNC' for conv in convergence_time.values()):
+            logging.info('\nnWet and volume converged at t = %.4f - the simulation can be stopped' % max(convergence_time.values()))
+            return convergence_time, alarms
+
+        if time.time() - last_growth > stale_timeout:
+            logging.info('\n%s has not grown for %i s, stopping. Convergence times: %s' % (
+                hpctlf_filename, stale_timeout, convergence_time))
+            return convergence_time, alarms
+        time.sleep(poll_interval)
+
 if __name__ == "__main__":
+    if follow_hpc:
+        convergence_time, alarms = follow_hpc_file(follow_hpc)
+        sys.exit(1 if alarms else 0)
+
+    log_files = []
     for dir, subdirs, files in os.walk(log_folder):
         for log_file in files:
             if log_file.endswith('.tlf'):
-                run_id = log_file.split('_')[2]
-                run_id_folder = os.path.join(review_folder, run_id)
-                discharge = log_file.replace('.hpc.tlf', '').replace('.tlf', '')
-                discharge_folder = os.path.join(run_id_folder, discharge)
-
-                # create new folder for run ID and subfolder for discharge, if doesn't exist
-                if not os.path.exists(discharge_folder):
-                    logging.info('Creating discharge folder for {0}'.format(discharge))
-                    os.makedirs(discharge_folder)
-
-                source_path = os.path.join(dir, log_file)  # path of log file in results log folder
-                log_filename = os.path.join(discharge_folder, log_file)  # log filename
-
-                # copy log file to review/runID/discharge folder
-                shutil.copy(source_path, discharge_folder)
-                logging.info(
-                    'log files have been copied from the results folder to discharge folder for {0}'.format(discharge))
-
-                # for hpc.tlf file
-                if log_file.endswith('.hpc.tlf'):
-                    # run trending check and determine final discharge
-                    logging.info('Running convergence check function for {0}'.format(discharge_folder))
-                    trending_check(hpctlf_filename=log_filename)
-                # for regular .tlf file
-                else:
-                    logging.info('Running log info function for {0}'.format(discharge_folder))
-                    log_info(tlf_filename=log_filename)
+                log_files.append(os.path.join(dir, log_file))  # path of log file in results log folder
+    logging.info('Reviewing {0} log files with {1} worker(s)...'.format(len(log_files), workers))
+
+    summaries = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(review_log_file, source_path) for source_path in log_files]
+            plot_futures = []
+            for future in as_completed(futures):
+                summary, jobs = future.result()
+                summaries.append(summary)
+                logging.info('Finished {0} ({1}/{2})'.format(summary['discharge'], len(summaries), len(log_files)))
+                # render the plots on the same pool while the remaining reviews run
+                plot_futures += [executor.submit(plot_series, **job) for job in jobs]
+            save_summary(summaries)
+            logging.info('Saving {0} plots...'.format(len(plot_futures)))
+            for future in plot_futures:
+                future.result()
+    else:
+        plot_jobs = []
+        for source_path in log_files:
+            summary, jobs = review_log_file(source_path)
+            summaries.append(summary)
+            plot_jobs += jobs
+            logging.info('Finished {0} ({1}/{2})'.format(summary['discharge'], len(summaries), len(log_files)))
+        save_summary(summaries)
+        logging.info('Saving {0} plots...'.format(len(plot_jobs)))
+        render_plots(plot_jobs)
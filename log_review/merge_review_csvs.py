@@ -1,67 +1,158 @@
 import os
+import io
+import hashlib
+import sqlite3
 import pandas as pd
 
 import logging
 FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 
+# review\\runID folder (or the review folder, to merge every runID in it)
 review_folder = 'Z:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\review\\133'
+# keep the review tables of every runID in a SQLite store (False = merge straight from the CSV files)
+# only the review CSVs that changed since the last merge are read into it, and the summaries are read back from it
+use_review_db = False
+# SQLite store file, on a local disk (None = a store for this review folder on the local disk, see default_review_db)
+# example: 'C:\\TUFLOW_review\\LYR17_1_EDDPD_review.sqlite'
+review_db = None
+# list the review folder for new, changed or removed review CSVs before the summaries
+# (False = summaries read from the store alone, use_review_db must be True)
+scan_review_folder = True
+# run IDs to summarize, e.g. ['133', '134'] (None = every run ID found in the review folder, or in the store)
+summary_run_ids = None
 
-# initializing csv file lists
-hpc_files = []
-review_files = []
-PO_conv_files = []
-
-# initializing dataframes
-hpc_sum = pd.DataFrame()
-log_review = pd.DataFrame()
-PO_conv = pd.DataFrame()
-review_summary = pd.DataFrame()
-
-# defining the run id from folder being review
-run_id = review_folder.split('\\')[-1]
-
-for dir, subdirs, files in os.walk(review_folder):
-    for review_file in files:
-        review_filename = os.path.join(dir, review_file)
-        # add hpc summary csv files to hpc_files list
-        logging.info(f'{run_id}: Adding hpc_summary.csv files to list...')
-        if review_file.endswith('hpc_summary.csv'):
-            hpc_files.append(review_filename)
-        # add log review csv files to review_files list
-        logging.info(f'{run_id}: Adding log_review.csv files to list...')
-        if review_file.endswith('log_review.csv'):
-            review_files.append(review_filename)
-        # PO convergence csv files to PO_files list
-        logging.info(f'{run_id}: Adding PO_convergence.csv files to list...')
-        if review_file.endswith('PO_convergence_times.csv'):
-            PO_conv_files.append(review_filename)
-
-for f in hpc_files:
-    # read csv files into data frame from hpc_file list
-    logging.info(f'{run_id}: Reading hpc_summary.csv files to data frame...')
-    df = pd.read_csv(f)
-    hpc_sum = hpc_sum.append(df, ignore_index=True)
-
-for f in review_files:
-    # read csv files into data frame from review_files list
-    logging.info(f'{run_id}: Reading log_review.csv files to data frame...')
-    df = pd.read_csv(f)
-    log_review = log_review.append(df, ignore_index=True)
-
-for f in PO_conv_files:
-    # read csv files into data from from PO_conv_files list
-    logging.info(f'{run_id}: Reading PO_convergence_times.csv files to data frame...')
-    df = pd.read_csv(f)
-    PO_conv = PO_conv.append(df, ignore_index=True)
-    # subset to columns we care about
-    PO_conv = PO_conv[['V conv time', 'Q conv time', 'Comments']]
-
-logging.info(f'{run_id}: Concatenating data frames into review summary data frame...')
-review_summary = pd.concat([log_review, hpc_sum, PO_conv], axis=1, join='inner', sort=True)
-review_sum_path = os.path.join(review_folder, f'{run_id}_review_summary.csv')
-logging.info(f'{run_id}: Writing review summary to {review_sum_path}...')
-review_summary.to_csv(review_sum_path, index=False)
+# review CSV file endings of each category
+categories = {'log_review': 'log_review.csv', 'hpc_summary': 'hpc_summary.csv', 'PO_convergence': 'PO_convergence_times.csv'}
 
 
+# find the review CSV files of each category under the review folder (in review\\runID\\discharge folders)
+# returns a list of (category, run ID, discharge, path)
+def find_review_csvs(review_folder):
+    review_csvs = []
+    for dir, subdirs, files in os.walk(review_folder):
+        discharge = os.path.basename(dir)
+        run_id = os.path.basename(os.path.dirname(dir))
+        for review_file in files:
+            for category, ending in categories.items():
+                if review_file.endswith(ending):
+                    review_csvs.append((category, run_id, discharge, os.path.join(dir, review_file)))
+    return review_csvs
 
+
+# combine the log review, hpc summary and PO convergence tables of each discharge into one review summary
+# tables is a dict of category: list of (discharge, data frame), rows are joined on discharge (not on file order) and
+# sorted by discharge, the discharges in all three are kept
+def review_summary(tables):
+    frames = []
+    for category in categories:
+        # one concat for each category (indexed by discharge)
+        if tables[category]:
+            df = pd.concat([df.assign(discharge=discharge) for discharge, df in tables[category]]).set_index('discharge')
+        else:
+            df = pd.DataFrame()
+        # subset to columns we care about
+        if category == 'PO_convergence':
+            df = df.reindex(columns=['V conv time', 'Q conv time', 'Comments'])
+        frames.append(df)
+    return pd.concat(frames, axis=1, join='inner').sort_index()
+
+
+# default review store of a review folder, on the local disk (%LOCALAPPDATA%, or the home folder)
+# SQLite locking is not reliable on network shares
+def default_review_db(review_folder):
+    review_folder = os.path.abspath(review_folder)
+    db_folder = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'TUFLOW_review_stores')
+    os.makedirs(db_folder, exist_ok=True)
+    folder_hash = hashlib.sha1(review_folder.lower().encode()).hexdigest()[:10]
+    return os.path.join(db_folder, f'{os.path.basename(review_folder)}_{folder_hash}.sqlite')
+
+
+# create the SQLite review store (one row per review CSV, keyed by category, run ID and discharge)
+def open_review_db(db_path):
+    con = sqlite3.connect(db_path)
+    con.execute('CREATE TABLE IF NOT EXISTS review_csvs (category TEXT, run_id TEXT, discharge TEXT, path TEXT, '
+                'mtime REAL, size INTEGER, csv TEXT, PRIMARY KEY (category, run_id, discharge))')
+    return con
+
+
+# read the review CSVs that are new or changed (modified time or size) since the last merge into the review store, and
+# remove the stored CSVs under the review folder (or anywhere, if the file is gone) that were not found again
+# returns the number of CSV files read and the number of stored CSVs removed
+def update_review_db(con, review_csvs, review_folder):
+    stored = {(category, run_id, discharge): (path, mtime, size) for category, run_id, discharge, path, mtime, size
+              in con.execute('SELECT category, run_id, discharge, path, mtime, size FROM review_csvs')}
+    updates = []
+    for category, run_id, discharge, path in review_csvs:
+        stat = os.stat(path)
+        if stored.get((category, run_id, discharge)) != (path, stat.st_mtime, stat.st_size):
+            with open(path) as f:
+                updates.append((category, run_id, discharge, path, stat.st_mtime, stat.st_size, f.read()))
+    found = {(category, run_id, discharge) for category, run_id, discharge, path in review_csvs}
+    prefix = os.path.join(review_folder, '')
+    stale = [key for key, (path, mtime, size) in stored.items()
+             if key not in found and (path.startswith(prefix) or not os.path.exists(path))]
+    with con:
+        con.executemany('INSERT OR REPLACE INTO review_csvs VALUES (?, ?, ?, ?, ?, ?, ?)', updates)
+        con.executemany('DELETE FROM review_csvs WHERE category = ? AND run_id = ? AND discharge = ?', stale)
+    return len(updates), len(stale)
+
+
+# run IDs with review CSVs under the review folder in the review store (without listing the folder)
+def stored_run_ids(con, review_folder):
+    prefix = os.path.join(review_folder, '')
+    return sorted({run_id for run_id, path in con.execute('SELECT run_id, path FROM review_csvs') if path.startswith(prefix)})
+
+
+# read the review tables of a run ID from the review store
+# returns a dict of category: list of (discharge, data frame)
+def query_review_db(con, run_id):
+    tables = {category: [] for category in categories}
+    for category, discharge, csv in con.execute('SELECT category, discharge, csv FROM review_csvs WHERE run_id = ?', (run_id,)):
+        tables[category].append((discharge, pd.read_csv(io.StringIO(csv))))
+    return tables
+
+
+if __name__ == "__main__":
+    if not (use_review_db or scan_review_folder):
+        raise ValueError('scan_review_folder = False needs use_review_db = True (the summaries are read from the store)')
+    if use_review_db:
+        db_path = review_db or default_review_db(review_folder)
+        con = open_review_db(db_path)
+
+    if scan_review_folder:
+        review_csvs = find_review_csvs(review_folder)
+        run_ids = sorted({run_id for category, run_id, discharge, path in review_csvs})
+        for category in categories:
+            logging.info('Found %i %s files' % (sum(1 for review_csv in review_csvs if review_csv[0] == category), categories[category]))
+        if use_review_db:
+            n_read, n_removed = update_review_db(con, review_csvs, review_folder)
+            logging.info('Read %i new or changed review CSV files into %s, removed %i no longer found' % (n_read, db_path, n_removed))
+    else:
+        # summaries straight from the store, the review folder is not listed
+        run_ids = stored_run_ids(con, review_folder)
+        logging.info('Found %i run IDs in %s' % (len(run_ids), db_path))
+    if summary_run_ids is not None:
+        run_ids = [str(run_id) for run_id in summary_run_ids]
+
+    for run_id in run_ids:
+        if use_review_db:
+            tables = query_review_db(con, run_id)
+        else:
+            logging.info(f'{run_id}: Reading review CSV files to data frames...')
+            tables = {category: [(discharge, pd.read_csv(path)) for c, r, discharge, path in review_csvs
+                                 if c == category and r == run_id] for category in categories}
+        if not any(tables.values()):
+            logging.info(f'{run_id}: No review CSV files found, skipping review summary')
+            continue
+
+        logging.info(f'{run_id}: Concatenating data frames into review summary data frame...')
+        summary_df = review_summary(tables)
+        # summary is saved in the runID folder
+        run_id_folder = review_folder if os.path.basename(review_folder) == run_id else os.path.join(review_folder, run_id)
+        review_sum_path = os.path.join(run_id_folder, f'{run_id}_review_summary.csv')
+        logging.info(f'{run_id}: Writing review summary to {review_sum_path}...')
+        summary_df.to_csv(review_sum_path)
+
+    if use_review_db:
+        con.close()
@@ -0,0 +1,119 @@
+# Python script for summarizing model runtimes across reaches, runIDs and discharges from the _log_review.csv files
+# (CPU Time, Clock Time and End Time (h) read from the .tlf by log_review.py)
+
+# Step 1 - run log_review.py for the runIDs to be compared (creates the _log_review.csv files in the review folders)
+# Step 2 - set the review folders (one per reach) and the folder to save the runtime tables to
+# Step 3 - check the runtime tables and the runs flagged as slower than the previous runID
+
+import os
+import re
+import pandas as pd
+import numpy as np
+
+import logging
+FORMAT = ">>> %(filename)s, ln %(lineno)s - %(funcName)s: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+# VARIABLES - MAKE CHANGES HERE (set folders)
+# review folders of each reach (containing the runID\\discharge review folders)
+# example: ['E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\review']
+review_folders = ['E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_1_EDDPD\\review',
+                  'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_2_DPDMRY\\review',
+                  'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\LYR17_3_MRYFR\\review']
+# folder to save the runtime tables to
+runtime_folder = 'E:\\LYR\\LYR_2017studies\\LYR17_2Dmodelling\\runtime_review'
+# flag runs with a clock time more than this many times the clock time of the same run in the previous runID
+regression_ratio = 1.5
+
+# DO NOT CHANGE ANYTHING BELOW (unless you know what you are doing)
+
+# return the cell size from the geometry control file commands echoed in the .tlf (NaN if not found)
+# the geometry is read before the simulation starts, so only the start of the log is read
+def cell_size(tlf_filename):
+    if not os.path.exists(tlf_filename):
+        return np.nan
+    with open(tlf_filename) as f:
+        for line in f:
+            if 'Cell Size ==' in line:
+                match = re.search(r'Cell Size ==\s*([-+.\deE]+)', line)
+                if match:
+                    return float(match.group(1))
+            if 'Simulation Started:' in line:
+                break
+    return np.nan
+
+# read a _log_review.csv to one row of the runtime table
+# run names are <reach>_<reach number>_<runID>_<event/variant...> (as in log_review.py)
+def runtime_row(log_review_filename):
+    log_df = pd.read_csv(log_review_filename, dtype=str)
+    run = os.path.basename(log_review_filename).replace('_log_review.csv', '')
+    name_parts = run.split('_')
+    mat_cols = [col for col in log_df.columns if col in ['Read GRID CnM ==', 'Fixed Manning\'s n = ']]
+    event_cols = [col for col in log_df.columns if col.startswith('BC Event Source')]
+    return {'run': run,
+            'reach': '_'.join(name_parts[:2]),
+            'runID': name_parts[2] if len(name_parts) > 2 else '',
+            # run name without the runID, to match the same run across runIDs
+            'run key': '_'.join(name_parts[:2] + name_parts[3:]),
+            'event': log_df[event_cols[0]][0] if event_cols else np.nan,
+            'Manning\'s n': log_df[mat_cols[0]][0] if mat_cols else np.nan,
+            'cell size': cell_size(log_review_filename.replace('_log_review.csv', '.tlf')),
+            'Simulation Started': log_df['Simulation Started'][0],
+            'End Time (h)': log_df['End Time (h)'][0],
+            'CPU Time (h)': log_df['CPU Time'][0],
+            'Clock Time (h)': log_df['Clock Time'][0]}
+
+# build the runtime table for all _log_review.csv files in the review folders
+# adds simulated hours per clock hour and compares each run to the same run in the previous runID
+def runtime_summary(review_folders, regression_ratio=1.5):
+    log_review_filenames = []
+    for review_folder in review_folders:
+        for dir, subdirs, files in os.walk(review_folder):
+            log_review_filenames.extend(os.path.join(dir, f) for f in files if f.endswith('_log_review.csv'))
+    logging.info('reading %i log review tables...' % len(log_review_filenames))
+    runtime_df = pd.DataFrame([runtime_row(f) for f in log_review_filenames],
+                              columns=['run', 'reach', 'runID', 'run key', 'event', 'Manning\'s n', 'cell size',
+                                       'Simulation Started', 'End Time (h)', 'CPU Time (h)', 'Clock Time (h)'])
+    for col in ['End Time (h)', 'CPU Time (h)', 'Clock Time (h)']:
+        runtime_df[col] = pd.to_numeric(runtime_df[col], errors='coerce')
+    # discharge from the event name (first number in it, e.g. Q1000 or 1000cfs), NaN for runs without an event name
+    # (as object, since the event column is all NaN floats when no log review has a BC Event Source)
+    events = runtime_df.event.astype(object)
+    runtime_df['discharge'] = pd.to_numeric(events.str.extract(r'(\d+(?:\.\d+)?)', expand=False), errors='coerce')
+    runtime_df['sim h per clock h'] = runtime_df['End Time (h)'] / runtime_df['Clock Time (h)']
+
+    # compare to the same run in the previous runID (runIDs sorted numerically where possible)
+    runtime_df['runID order'] = pd.to_numeric(runtime_df.runID, errors='coerce')
+    runtime_df = runtime_df.sort_values(['run key', 'runID order', 'runID']).reset_index(drop=True)
+    previous = runtime_df.groupby('run key')
+    runtime_df['previous runID'] = previous.runID.shift()
+    runtime_df['clock time ratio'] = runtime_df['Clock Time (h)'] / previous['Clock Time (h)'].shift()
+    runtime_df['regression'] = runtime_df['clock time ratio'] > regression_ratio
+    return runtime_df.drop(columns='runID order')
+
+
+if __name__ == "__main__":
+    if not os.path.exists(runtime_folder):
+        os.makedirs(runtime_folder)
+
+    runtime_df = runtime_summary(review_folders, regression_ratio)
+    runtime_path = os.path.join(runtime_folder, 'runtime_summary.csv')
+    runtime_df.to_csv(runtime_path, index=False)
+    logging.info('\nsaved runtime table: %s\n' % runtime_path)
+
+    # clock time against discharge (one column per reach and runID) and throughput against cell size
+    by_discharge = runtime_df.pivot_table(index='discharge', columns=['reach', 'runID'], values='Clock Time (h)')
+    by_discharge_path = os.path.join(runtime_folder, 'clock_time_by_discharge.csv')
+    by_discharge.to_csv(by_discharge_path)
+    logging.info('saved clock time by discharge table: %s' % by_discharge_path)
+    by_cell_size = runtime_df.groupby(['reach', 'cell size'])[['Clock Time (h)', 'sim h per clock h']].agg(['count', 'mean', 'min', 'max'])
+    by_cell_size_path = os.path.join(runtime_folder, 'runtime_by_cell_size.csv')
+    by_cell_size.to_csv(by_cell_size_path)
+    logging.info('saved runtime by cell size table: %s\n' % by_cell_size_path)
+
+    regressions = runtime_df[runtime_df.regression]
+    for _, row in regressions.iterrows():
+        logging.info('SLOWER RUN: %s clock time %.2f h is %.1f x the clock time of runID %s' % (
+            row.run, row['Clock Time (h)'], row['clock time ratio'], row['previous runID']))
+    logging.info('%i of %i runs are more than %.1f x slower than the previous runID' % (
+        len(regressions), len(runtime_df), regression_ratio))
@@ -0,0 +1,131 @@
+# Shared rolling window statistics and plotting for the TUFLOW review scripts (PO_convergence.py and log_review.py)
+# Keep this file in the top-level folder of the scripts (or next to a copied review script) so it can be imported
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# sliding maximum (or minimum with func=np.minimum) over each window of w rows of a 2D array in O(n)
+# (van Herk/Gil-Werman: combine suffix and prefix running extremes of w-sized blocks)
+def sliding_extreme(a, w, func=np.maximum):
+    n, m = a.shape
+    n_win = n - w + 1
+    fill = -np.inf if func is np.maximum else np.inf
+    pad_n = -(-n // w) * w
+    padded = np.full((pad_n, m), fill)
+    padded[:n] = a
+    blocks = padded.reshape(-1, w, m)
+    prefix = func.accumulate(blocks, axis=1).reshape(pad_n, m)
+    suffix = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(pad_n, m)
+    return func(suffix[:n_win], prefix[w - 1:w - 1 + n_win])
+
+
+# slope of the linear regression line of y against t for every window of w consecutive values
+# built from cumulative sums (sum t, sum y, sum ty, sum t^2) so each window costs O(1) instead of a polyfit
+# the windows are taken in blocks of w, each from its own 2w - 1 rows shifted to their mean, so the sums never grow
+# with the length of the series (global sums cancel badly on multi-day runs, e.g. constant nWet gave non-zero slopes)
+# y can be 1D or 2D (rows = timesteps, one regression per column)
+# returns n - w + 1 slopes (one per window start), empty if there are fewer than w values
+def rolling_slopes(t, y, w, chunk_rows=2 ** 20):
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(t)
+    if n < w:
+        return np.empty((0,) + y.shape[1:])
+    n_win = n - w + 1
+    n_blocks = -(-n_win // w)
+    slopes = np.empty((n_blocks * w,) + y.shape[1:])
+    # rows of each block (the last block is padded with the last row, those windows are dropped)
+    offsets = np.arange(2 * w - 1)
+    blocks_per_chunk = max(chunk_rows // (2 * w), 1)
+    for block0 in range(0, n_blocks, blocks_per_chunk):
+        starts = np.arange(block0, min(block0 + blocks_per_chunk, n_blocks)) * w
+        rows = np.minimum(starts[:, np.newaxis] + offsets, n - 1)
+        # shift t and y of each block to their means (slope is unchanged) to limit round-off in the sums
+        tb = t[rows]
+        yb = y[rows]
+        tb -= tb.mean(axis=1, keepdims=True)
+        yb -= yb.mean(axis=1, keepdims=True)
+        if y.ndim == 2:
+            tb = tb[:, :, np.newaxis]
+
+        # sums of the w windows of each block from the difference of cumulative sums (leading zero column)
+        def window_sum(a):
+            c = np.cumsum(a, axis=1)
+            c = np.concatenate([np.zeros_like(c[:, :1]), c], axis=1)
+            return c[:, w:2 * w] - c[:, :w]
+
+        sum_t = window_sum(tb)
+        sum_y = window_sum(yb)
+        sum_ty = window_sum(tb * yb)
+        sum_tt = window_sum(tb * tb)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block_slopes = (w * sum_ty - sum_t * sum_y) / (w * sum_tt - sum_t * sum_t)
+        slopes[starts[0]:starts[0] + len(starts) * w] = block_slopes.reshape((-1,) + y.shape[1:])
+    return slopes[:n_win]
+
+
+# reduce a long series to the first and last points plus the min and max of each of n_buckets equal-length buckets
+# (one bucket per pixel column keeps every spike and the convergence tail visible, at a constant plotting cost)
+# returns the (x, y) points kept, in their original order
+def decimate_minmax(x, y, n_buckets):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    # (a series already decimated to n_buckets is returned as it is)
+    if n <= 2 * n_buckets + 2:
+        return x, y
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+    # pad the last bucket with the last value so every bucket has the same length
+    padded = np.concatenate([y, np.repeat(y[-1:], n_buckets * size - n)]).reshape(n_buckets, size)
+    starts = np.arange(n_buckets) * size
+    keep = np.concatenate([[0, n - 1], starts + padded.argmin(axis=1), starts + padded.argmax(axis=1)])
+    keep = np.unique(np.minimum(keep, n - 1))
+    return x[keep], y[keep]
+
+
+# reusable figure, axes and line for the plots saved by this process (created on first use)
+_plot_artists = {}
+
+
+# save a line plot of y against x to png_path, updating the data of this process's reusable figure in place
+# (Agg canvas, no pyplot state machine) - long series are decimated to the min/max of each pixel column first
+# extra keyword arguments are passed to savefig
+def plot_series(png_path, x, y, title, xlabel, ylabel, **savefig_kwargs):
+    if not _plot_artists:
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        line, = ax.plot([], [])
+        _plot_artists.update(fig=fig, ax=ax, line=line)
+    fig, ax, line = _plot_artists['fig'], _plot_artists['ax'], _plot_artists['line']
+
+    line.set_data(*decimate_minmax(x, y, int(fig.get_figwidth() * fig.dpi)))
+    ax.relim()
+    ax.autoscale_view()
+    ax.set_title(title)
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel(ylabel, fontsize=12)
+    fig.savefig(png_path, **savefig_kwargs)
+    return png_path
+
+
+# deferred plot (dict of plot_series arguments) holding only the points plot_series would draw, so a list of plots
+# kept until the end of a batch or sent between processes stays small however long the series are
+def plot_job(png_path, x, y, title, xlabel, ylabel, **savefig_kwargs):
+    x, y = decimate_minmax(x, y, int(rcParams['figure.figsize'][0] * rcParams['figure.dpi']))
+    return dict(png_path=png_path, x=np.array(x), y=np.array(y), title=title, xlabel=xlabel, ylabel=ylabel,
+                **savefig_kwargs)
+
+
+# render a list of deferred plots (dicts of plot_series arguments), spread over a process pool if workers > 1
+def render_plots(plot_jobs, workers=1):
+    if workers > 1 and len(plot_jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(plot_series, **job) for job in plot_jobs]
+            return [future.result() for future in futures]
+    return [plot_series(**job) for job in plot_jobs]